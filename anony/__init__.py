@@ -36,9 +36,15 @@ boot = time.time()
 from anony.core.bot import Bot
 app = Bot()
 
+from anony.core.sender import Sender
+sender = Sender()
+
 from anony.core.dir import ensure_dirs
 ensure_dirs()
 
+from anony.core.storage import Storage
+storage = Storage()
+
 from anony.core.userbot import Userbot
 userbot = Userbot()
 
@@ -48,6 +54,12 @@ db = MongoDB()
 from anony.core.lang import Language
 lang = Language()
 
+from anony.core.scheduler import Scheduler
+scheduler = Scheduler()
+
+from anony.core.bandwidth import Bandwidth
+bandwidth = Bandwidth()
+
 from anony.core.telegram import Telegram
 from anony.core.youtube import YouTube
 tg = Telegram()
@@ -8,7 +8,7 @@ import importlib
 
 from pyrogram import idle
 
-from anony import anon, app, db, logger, tasks, userbot
+from anony import anon, app, db, logger, scheduler, sender, tasks, userbot, yt
 from anony.plugins import all_modules
 
 
@@ -29,9 +29,13 @@ async def main():
 
     await idle()
     logger.info("Stopping...")
+    await sender.close()
     await app.exit()
     await userbot.exit()
+    await db.flush()
     await db.close()
+    await scheduler.close()
+    yt.close()
     for task in tasks:
         task.cancel()
         try:
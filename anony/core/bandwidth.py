@@ -0,0 +1,97 @@
+# Copyright (c) 2025 AnonymousX1025
+# Licensed under the MIT License.
+# This file is part of AnonXMusic
+
+
+import asyncio
+import threading
+import time
+from collections import Counter, deque
+
+from anony import config
+from anony.core.scheduler import Priority
+
+
+class Bandwidth:
+    """
+    Token-bucket governor shared by YouTube and Telegram downloads.
+
+    The global rate is BANDWIDTH_LIMIT minus STREAM_RESERVE for every active
+    voice chat, and each priority may only use its share of that rate. Buckets
+    are allowed to go into debt, so a large chunk is granted at once and the
+    next one waits until the debt has been paid back.
+    """
+
+    shares = {
+        Priority.NOW_PLAYING: 1.0,
+        Priority.FORCE: 1.0,
+        Priority.PREFETCH: 0.5,
+        Priority.BACKGROUND: 0.25,
+    }
+
+    def __init__(self):
+        self.limit = config.BANDWIDTH_LIMIT * 1024 * 1024
+        self.reserve = config.STREAM_RESERVE * 1024
+        self.lock = threading.Lock()
+        self.tokens: dict[Priority | None, float] = {}
+        self.updated: dict[Priority | None, float] = {}
+        self.recent: deque[tuple[float, int, Priority]] = deque()
+        self.total = Counter()
+
+    def rate(self, priority: Priority = None) -> float:
+        """Current allowance in bytes/s for a priority (or overall)."""
+        from anony import db
+
+        rate = max(self.limit - self.reserve * len(db.active_calls), self.limit * 0.1)
+        return rate * self.shares[priority] if priority is not None else rate
+
+    def _refill(self, bucket: Priority | None, now: float) -> float:
+        rate = self.rate(bucket)
+        tokens = self.tokens.get(bucket, rate)
+        elapsed = now - self.updated.get(bucket, now)
+        self.tokens[bucket] = min(tokens + elapsed * rate, rate)
+        self.updated[bucket] = now
+        return rate
+
+    def _take(self, size: int, priority: Priority) -> float:
+        """Grant `size` bytes and return 0, or return how long to wait."""
+        now = time.monotonic()
+        with self.lock:
+            if self.limit:
+                wait = 0.0
+                for bucket in (None, priority):
+                    rate = self._refill(bucket, now)
+                    if self.tokens[bucket] < 0:
+                        wait = max(wait, -self.tokens[bucket] / rate)
+                if wait:
+                    return wait
+                self.tokens[None] -= size
+                self.tokens[priority] -= size
+
+            self.total[priority] += size
+            self.recent.append((now, size, priority))
+            while self.recent and self.recent[0][0] < now - 10:
+                self.recent.popleft()
+            return 0.0
+
+    def consume(self, size: int, priority: Priority) -> None:
+        """Blocking variant for worker threads (yt-dlp progress hooks)."""
+        while size > 0 and (wait := self._take(size, priority)):
+            time.sleep(min(wait, 1.0))
+
+    async def aconsume(self, size: int, priority: Priority) -> None:
+        """Async variant for the event loop (Pyrogram progress callbacks)."""
+        while size > 0 and (wait := self._take(size, priority)):
+            await asyncio.sleep(min(wait, 1.0))
+
+    def stats(self) -> dict:
+        """Throughput over the last 10 seconds in bytes/s, per priority."""
+        with self.lock:
+            window = Counter()
+            for _, size, priority in self.recent:
+                window[priority] += size
+        return {
+            "limit": int(self.rate()) if self.limit else None,
+            "total": sum(window.values()) // 10,
+            **{p.name.lower(): window[p] // 10 for p in Priority},
+        }
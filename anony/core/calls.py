@@ -6,6 +6,8 @@
 # PY-TGCALLS 1.2.9 (ses) + NTGCALLS 1.1.3 uyumlu, Heroku-stabil sürüm.
 
 import asyncio
+import time
+from collections import defaultdict, deque
 from typing import List, Optional, Tuple, Any, Callable
 
 from ntgcalls import ConnectionNotFound, TelegramServerError
@@ -13,7 +15,9 @@ from pyrogram.types import InputMediaPhoto, Message
 from pytgcalls import PyTgCalls, exceptions
 from pytgcalls.pytgcalls_session import PyTgCallsSession
 
-from anony import app, config, db, lang, logger, queue, userbot, yt
+from anony import app, config, db, lang, logger, queue, sender, tg, userbot, yt
+from anony.core.scheduler import Priority
+from anony.core.sender import Lane
 from anony.helpers import Media, Track, buttons, thumb
 
 
@@ -57,6 +61,45 @@ class TgCall:
     """
     def __init__(self):
         self.clients: List[PyTgCalls] = []
+        self.prefetching: dict[int, Tuple[str, asyncio.Task]] = {}
+        self.prefetch_limit = asyncio.Semaphore(config.PREFETCH_LIMIT)
+        self.failures: dict[int, deque[float]] = defaultdict(deque)
+        # Katılımcı sayısı önbelleği (asistan dahil), join/leave eventleriyle güncel
+        self.participants: dict[int, int] = {}
+        self.alone_since: dict[int, float] = {}
+
+    def recent_failures(self, num: int, window: int = 600) -> int:
+        """Asistanın (1 tabanlı) son `window` saniyedeki katılma hataları."""
+        failures = self.failures[num]
+        while failures and failures[0] < time.monotonic() - window:
+            failures.popleft()
+        return len(failures)
+
+    def _failed(self, client: PyTgCalls) -> None:
+        if client in self.clients:
+            self.failures[self.clients.index(client) + 1].append(time.monotonic())
+
+    # -------------------------
+    # KATILIMCI TAKİBİ
+    # -------------------------
+    def _set_participants(self, chat_id: int, count: int) -> None:
+        self.participants[chat_id] = count
+        if count < 2:
+            self.alone_since.setdefault(chat_id, time.monotonic())
+        else:
+            self.alone_since.pop(chat_id, None)
+
+    async def count_participants(self, chat_id: int) -> int:
+        """Katılımcıları API'den sayar ve önbelleği düzeltir."""
+        client = await db.get_assistant(chat_id)
+        count = len(await client.get_participants(chat_id))
+        self._set_participants(chat_id, count)
+        return count
+
+    def alone_for(self, chat_id: int) -> float:
+        """Asistanın sohbette kaç saniyedir yalnız olduğu (bilinmiyorsa 0)."""
+        since = self.alone_since.get(chat_id)
+        return time.monotonic() - since if since else 0.0
 
     # -------------------------
     # TEMEL KONTROLLER
@@ -64,16 +107,23 @@ class TgCall:
     async def pause(self, chat_id: int) -> bool:
         client = await db.get_assistant(chat_id)
         await db.playing(chat_id, paused=True)
+        if media := queue.get_current(chat_id):
+            media.pause()
         # pause_stream (1.2.9), bazı varyantlarda pause
         return await _try_call(client, "pause_stream", ["pause"], chat_id)
 
     async def resume(self, chat_id: int) -> bool:
         client = await db.get_assistant(chat_id)
         await db.playing(chat_id, paused=False)
+        if media := queue.get_current(chat_id):
+            media.resume()
         # resume_stream (1.2.9), bazı varyantlarda resume
         return await _try_call(client, "resume_stream", ["resume"], chat_id)
 
     async def stop(self, chat_id: int) -> None:
+        self.cancel_prefetch(chat_id)
+        self.participants.pop(chat_id, None)
+        self.alone_since.pop(chat_id, None)
         client = await db.get_assistant(chat_id)
         # Sesten çık (1.2.9: leave_group_call; bazı paketlerde leave_call)
         try:
@@ -95,7 +145,8 @@ class TgCall:
         chat_id: int,
         message: Message,
         media: Media | Track,
-        seek_time: int = 0,  # 1.2.9’da ffmpeg seek doğrudan yok; basit akış
+        seek_time: int = 0,  # saniye; ffmpeg'e giriş ofseti (-ss) olarak verilir
+        priority: Priority = Priority.NOW_PLAYING,
     ) -> None:
         """
         Sadece ses akışı: AudioPiped + HighQualityAudio
@@ -115,29 +166,73 @@ class TgCall:
             else config.DEFAULT_THUMB
         )
 
-        # Kaynak dosya
-        if not getattr(media, "file_path", None):
+        # Kaynak: yerel dosya ya da (STREAM_MODE) doğrudan YouTube adresi
+        source, headers, params = getattr(media, "file_path", None), None, []
+        if not source and isinstance(media, Track):
+            resolved = (
+                await yt.stream(media.id, video=media.video, priority=priority)
+                if config.STREAM_MODE
+                else None
+            )
+            if resolved:
+                source, headers = resolved
+                params.append(yt.reconnect)
+            else:
+                source = await self._fetch(media, priority)
+
+        elif source and (partial := tg.partial(source)):
+            # Telegram dosyası hâlâ iniyor: indirme bitince kapanan bir pipe'tan oku
+            source = partial
+
+        if not source:
+            await self.stop(chat_id)
             return await message.edit_text(
                 _lang["error_no_file"].format(config.SUPPORT_CHAT)
             )
 
+        def _stream(path: str, headers: dict = None, params: list = ()):
+            # -ss girişten (-i) önce verilir: ffmpeg en yakın anahtar kareye atlar
+            params = ([f"-ss {seek_time}"] if seek_time else []) + list(params)
+            kwargs = {"additional_ffmpeg_parameters": " ".join(params)} if params else {}
+            if headers is not None:
+                kwargs["headers"] = headers
+            return AudioPiped(path, audio_parameters=HighQualityAudio(), **kwargs)
+
         # Akış oluştur
-        stream = AudioPiped(
-            media.file_path,
-            audio_parameters=HighQualityAudio(),
-        )
+        stream = _stream(source, headers, params)
+        remote = headers is not None
+
+        # Asistan zaten sesliyse akışı yerinde değiştir, değilse katıl
+        in_call = chat_id in db.active_calls
 
         # Bağlan / yeniden dene
-        retry = 0
+        retry, connected = 0, False
         while True:
             try:
-                # 1.2.9: join_group_call; bazı varyantlarda join_call
-                await _try_call(client, "join_group_call", ["join_call"], chat_id, stream)
+                if in_call:
+                    try:
+                        # 1.2.9: change_stream; yeni sürümlerde play
+                        await _try_call(client, "change_stream", ["play"], chat_id, stream)
+                    except Exception as e:
+                        logger.warning(f"[calls] change_stream failed, rejoining: {e}")
+                        in_call = False
+                if not in_call:
+                    # 1.2.9: join_group_call; bazı varyantlarda join_call
+                    await _try_call(client, "join_group_call", ["join_call"], chat_id, stream)
+                    in_call = True
+                # Buradan sonraki hatalar asistanın değil (DB, mesaj düzenleme)
+                connected = True
                 media.playing = True
+                media.start(seek_time)
                 await db.add_call(chat_id)
+                try:
+                    await db.touch_chat(db.assistant[chat_id], chat_id)
+                except Exception as e:
+                    logger.warning(f"[calls] touch_chat failed: {e}")
 
                 # Şarkı bilgisini gönder
-                await message.edit_media(
+                await sender.call(
+                    message.edit_media,
                     InputMediaPhoto(
                         media=_thumb,
                         caption=_lang["play_media"].format(
@@ -148,7 +243,11 @@ class TgCall:
                         ),
                     ),
                     reply_markup=buttons.controls(chat_id),
+                    peer=chat_id,
+                    lane=Lane.NOW_PLAYING,
+                    key=("edit", chat_id, message.id),
                 )
+                self.prefetch(chat_id)
                 return
             except exceptions.NoActiveGroupCall:
                 await self.stop(chat_id)
@@ -163,15 +262,47 @@ class TgCall:
                     )
                     await asyncio.sleep(backoff)
                     continue
+                if not connected:
+                    self._failed(client)
                 await self.stop(chat_id)
                 await message.edit_text(_lang["error_tg_server"])
                 return
             except Exception as e:
+                if connected:
+                    # Akış çalıyor; yalnızca sonraki adım başarısız oldu
+                    logger.warning(f"[calls] after join: {e}")
+                    return
+                # Doğrudan akış başarısızsa indirip dosyadan tekrar dene
+                if remote and isinstance(media, Track) and (source := await self._fetch(media, priority)):
+                    logger.warning(f"[calls] stream failed, falling back to download: {e}")
+                    stream, remote = _stream(source), False
+                    continue
                 logger.error(f"[calls] join_group_call unexpected error: {e}")
+                self._failed(client)
                 await self.stop(chat_id)
                 await message.edit_text(_lang["error_tg_server"])
                 return
 
+    # -------------------------
+    # TEKRAR ÇAL
+    # -------------------------
+    async def replay(self, chat_id: int) -> None:
+        media = queue.get_current(chat_id)
+        if not media:
+            return await self.stop(chat_id)
+
+        _lang = await lang.get_lang(chat_id)
+        msg = await sender.call(
+            app.send_message,
+            chat_id=chat_id,
+            text=_lang["play_again"],
+            peer=chat_id,
+            lane=Lane.NOW_PLAYING,
+        )
+        media.message_id = msg.id
+        media.time = 0
+        await self.play_media(chat_id, msg, media)
+
     # -------------------------
     # SIRADAKİ PARÇA
     # -------------------------
@@ -191,27 +322,86 @@ class TgCall:
             except Exception:
                 pass
 
-        # Kuyruktan sıradaki
+        # Kuyruktan sıradaki (ön indirme sürüyorsa yt.download ona bağlanır)
         media = queue.get_next(chat_id)
+        self.cancel_prefetch(chat_id, keep=getattr(media, "id", None))
         if not media:
             return await self.stop(chat_id)
 
         _lang = await lang.get_lang(chat_id)
-        msg = await app.send_message(chat_id=chat_id, text=_lang["play_next"])
-
-        # Gerekirse indir
-        if not getattr(media, "file_path", None):
-            try:
-                media.file_path = await yt.download(media.id, video=media.video)
-            except Exception:
-                await self.stop(chat_id)
-                return await msg.edit_text(
-                    _lang["error_no_file"].format(config.SUPPORT_CHAT)
-                )
+        msg = await sender.call(
+            app.send_message,
+            chat_id=chat_id,
+            text=_lang["play_next"],
+            peer=chat_id,
+            lane=Lane.NOW_PLAYING,
+        )
 
         media.message_id = msg.id
         await self.play_media(chat_id, msg, media)
 
+    # -------------------------
+    # ÖN İNDİRME
+    # -------------------------
+    def prefetch(self, chat_id: int) -> None:
+        """
+        Çalan parça sürerken kuyruktaki bir sonraki parçayı (ve kapağını)
+        arka planda hazırlar. Eşzamanlı ön indirmeler PREFETCH_LIMIT ile sınırlı.
+        """
+        items = queue.get_queue(chat_id)
+        media = items[1] if len(items) > 1 else None
+        current = self.prefetching.get(chat_id)
+        if current and media and current[0] == media.id and not current[1].done():
+            return
+
+        self.cancel_prefetch(chat_id)
+        if not isinstance(media, Track) or media.file_path:
+            return
+
+        def _done(task: asyncio.Task) -> None:
+            if self.prefetching.get(chat_id, (None, None))[1] is task:
+                self.prefetching.pop(chat_id, None)
+
+        task = asyncio.create_task(self._prefetch(media))
+        self.prefetching[chat_id] = (media.id, task)
+        task.add_done_callback(_done)
+
+    def cancel_prefetch(self, chat_id: int, keep: str = None) -> None:
+        """
+        Ön indirmeyi bırakır. `keep` ile aynı parçanınki sürmeye devam eder ki
+        çalma ona bağlansın; iptal edilen görev de yalnızca indirmeden ayrılır,
+        başlamış bir yt-dlp işi yarıda kesilmez.
+        """
+        entry = self.prefetching.pop(chat_id, None)
+        if entry and entry[0] != keep and not entry[1].done():
+            entry[1].cancel()
+
+    async def _fetch(
+        self, media: Track, priority: Priority = Priority.NOW_PLAYING
+    ) -> Optional[str]:
+        try:
+            media.file_path = await yt.download(
+                media.id, video=media.video, priority=priority
+            )
+        except Exception as e:
+            logger.warning(f"[calls] download failed for {media.id}: {e}")
+        return media.file_path
+
+    async def _prefetch(self, media: Track) -> None:
+        async with self.prefetch_limit:
+            try:
+                if config.STREAM_MODE:
+                    await yt.stream(media.id, video=media.video, priority=Priority.PREFETCH)
+                elif not media.file_path:
+                    media.file_path = await yt.download(
+                        media.id, video=media.video, priority=Priority.PREFETCH
+                    )
+                await thumb.generate(media)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"[calls] prefetch failed for {media.id}: {e}")
+
     # -------------------------
     # PİNG
     # -------------------------
@@ -253,8 +443,31 @@ class TgCall:
         else:
             logger.info("[calls] on_stream_end decorator not available")
 
-        # Not: ChatUpdate benzeri eventler farklı sürümlerde değişken.
-        # Uyumsuzluk yaşamamak için ekstra event bağlamıyoruz.
+        # Katılımcı girdi/çıktı → sayaç önbelleği. Update tipi sürüme göre
+        # Joined/LeftGroupCallParticipant ya da `participant.action` taşır.
+        on_participants_change = getattr(client, "on_participants_change", None)
+        if callable(on_participants_change):
+            try:
+                @on_participants_change()
+                async def _on_participants(_, update):
+                    chat_id = getattr(update, "chat_id", None)
+                    if chat_id not in self.participants:
+                        return  # sayılmamış sohbet; watcher API'den sayar
+                    action = getattr(getattr(update, "participant", None), "action", None)
+                    kind = str(getattr(action, "name", "")) or type(update).__name__
+                    if kind.upper().startswith("JOINED"):
+                        delta = 1
+                    elif kind.upper().startswith("LEFT"):
+                        delta = -1
+                    else:
+                        return
+                    self._set_participants(
+                        chat_id, max(self.participants[chat_id] + delta, 0)
+                    )
+            except Exception as e:
+                logger.warning(f"[calls] bind on_participants_change failed: {e}")
+        else:
+            logger.info("[calls] on_participants_change decorator not available")
 
     # -------------------------
     # BAŞLAT
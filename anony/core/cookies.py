@@ -0,0 +1,201 @@
+# Copyright (c) 2025 AnonymousX1025
+# Licensed under the MIT License.
+# This file is part of AnonXMusic
+
+
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Hashable
+
+from anony import config, logger
+from anony.core.scheduler import Priority
+
+
+@dataclass
+class Cookie:
+    path: str
+    success: int = 0
+    failure: int = 0
+    streak: int = 0
+    strikes: int = 0
+    latency: float = 0.0
+    active: int = 0
+    until: float = 0.0
+
+    @property
+    def score(self) -> float:
+        rate = (self.success + 1) / (self.success + self.failure + 2)
+        return rate / (1 + self.latency / 10)
+
+
+@dataclass
+class Lease:
+    path: str | None
+    ok: bool = False
+    started: float = 0.0
+
+
+class CookiePool:
+    """
+    Health-aware selection of the cookie files in anony/cookies.
+
+    Cookies are picked with a probability weighted by success rate and
+    latency, capped at COOKIE_LIMIT concurrent requests each, and quarantined
+    with exponential backoff after repeated failures. Leases are taken on the
+    event loop before a job is handed to the scheduler, so waiting for a
+    cookie never ties up a worker thread, and waiters are served by priority
+    so a track someone is waiting on goes ahead of prefetches.
+    """
+
+    def __init__(self, path: str = "anony/cookies"):
+        self.path = path
+        self.limit = config.COOKIE_LIMIT
+        self.cookies: list[Cookie] = []
+        self.waiters: list[tuple[Priority, int, asyncio.Future]] = []
+        self.waiting: dict[Hashable, asyncio.Future] = {}
+        self.seq = itertools.count()
+        self.checked = False
+
+    def load(self) -> None:
+        self.cookies = [
+            Cookie(f"{self.path}/{file}")
+            for file in sorted(os.listdir(self.path))
+            if file.endswith(".txt")
+        ]
+        self.checked = True
+
+    def _healthy(self) -> list[Cookie]:
+        now = time.time()
+        return [c for c in self.cookies if c.until <= now] or self.cookies
+
+    def _take(self, force: bool = False) -> Cookie | None:
+        """
+        Claim a healthy cookie with spare capacity. With `force`, fall back
+        to the least loaded healthy cookie over its limit.
+        """
+        free = [c for c in self._healthy() if c.active < self.limit]
+        if free:
+            cookie = random.choices(free, weights=[c.score for c in free])[0]
+        elif force:
+            cookie = min(self._healthy(), key=lambda c: c.active)
+        else:
+            return None
+        cookie.active += 1
+        return cookie
+
+    def _wake(self) -> None:
+        """Hand freed capacity to the most urgent waiters."""
+        while self.waiters:
+            _, _, future = self.waiters[0]
+            if future.done():
+                heapq.heappop(self.waiters)
+                continue
+            cookie = self._take()
+            if not cookie:
+                return
+            heapq.heappop(self.waiters)
+            future.set_result(cookie)
+
+    def bump(self, key: Hashable, priority: Priority) -> None:
+        """Move the waiter registered under `key` up to `priority`."""
+        future = self.waiting.get(key)
+        if future and not future.done():
+            # The old entry is skipped once the future is resolved.
+            heapq.heappush(self.waiters, (priority, next(self.seq), future))
+
+    async def acquire(
+        self,
+        priority: Priority = Priority.BACKGROUND,
+        timeout: float = None,
+        key: Hashable = None,
+    ) -> Cookie | None:
+        """
+        Pick a healthy cookie with spare capacity, queueing behind more
+        urgent waiters until one frees up. After `timeout` seconds (5 for
+        a track someone is waiting on, 30 otherwise) the least loaded healthy
+        cookie is used over its limit. Returns None only if there are no cookies.
+        """
+        if not self.checked:
+            self.load()
+        if not self.cookies:
+            return None
+        if not self.waiters and (cookie := self._take()):
+            return cookie
+
+        if timeout is None:
+            timeout = 5 if priority <= Priority.FORCE else 30
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.seq), future))
+        if key is not None:
+            self.waiting[key] = future
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if future.done():
+                return future.result()
+            future.cancel()
+            return self._take(force=True)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._put(future.result())
+            future.cancel()
+            raise
+        finally:
+            if key is not None and self.waiting.get(key) is future:
+                self.waiting.pop(key)
+
+    def _put(self, cookie: Cookie) -> None:
+        cookie.active -= 1
+        self._wake()
+
+    def release(self, cookie: Cookie, ok: bool, latency: float) -> None:
+        if ok:
+            cookie.success += 1
+            cookie.streak = cookie.strikes = 0
+            cookie.latency = 0.8 * cookie.latency + 0.2 * latency
+        else:
+            cookie.failure += 1
+            cookie.streak += 1
+            if cookie.streak >= 3:
+                backoff = min(60 * 2**cookie.strikes, 3600)
+                cookie.until = time.time() + backoff
+                cookie.strikes += 1
+                cookie.streak = 0
+                logger.warning(f"Cookie {cookie.path} quarantined for {backoff}s.")
+        self._put(cookie)
+
+    @asynccontextmanager
+    async def lease(self, priority: Priority = Priority.BACKGROUND, key: Hashable = None):
+        """
+        Borrow a cookie for one request. The worker sets `lease.started` when
+        it begins and `lease.ok = True` on success; anything else, including
+        an exception, counts as a failure.
+        """
+        cookie = await self.acquire(priority, key=key)
+        lease = Lease(cookie.path if cookie else None)
+        try:
+            yield lease
+        finally:
+            if cookie:
+                latency = time.monotonic() - lease.started if lease.started else 0.0
+                self.release(cookie, lease.ok, latency)
+
+    def stats(self) -> list[dict]:
+        now = time.time()
+        return [
+            {
+                "cookie": os.path.basename(c.path),
+                "success": c.success,
+                "failure": c.failure,
+                "latency": round(c.latency, 2),
+                "active": c.active,
+                "quarantined": max(0, int(c.until - now)),
+            }
+            for c in self.cookies
+        ]
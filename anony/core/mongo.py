@@ -3,10 +3,15 @@
 # This file is part of AnonXMusic
 
 
-from random import randint
+import asyncio
+import heapq
+from collections import defaultdict
+from datetime import datetime, timezone
+from random import randint, random
 from time import time
 
-from pymongo import AsyncMongoClient
+from pymongo import AsyncMongoClient, DeleteOne, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
 
 from anony import config, logger, userbot
 
@@ -21,7 +26,7 @@ class MongoDB:
 
         self.admin_list = {}
         self.active_calls = {}
-        self.blacklisted = []
+        self.blacklisted: set[int] = set()
         self.notified = []
         self.cache = self.db.cache
         self.logger = False
@@ -32,18 +37,39 @@ class MongoDB:
         self.auth = {}
         self.authdb = self.db.auth
 
-        self.chats = []
+        self.chats: set[int] = set()
         self.chatsdb = self.db.chats
 
+        self.joined: dict[int, dict[int, dict]] = {}
+        self.joined_seeded: set[int] = set()
+        self.joineddb = self.db.joined
+
         self.lang = {}
         self.langdb = self.db.lang
 
-        self.play_mode = []
+        self.media = {}
+        self.mediadb = self.db.media
+
+        self.play_mode: dict[int, bool] = {}
         self.playmodedb = self.db.play
 
-        self.users = []
+        self.searchdb = self.db.search
+
+        self.users: set[int] = set()
         self.usersdb = self.db.users
 
+        # Names of the id indexes ("chats", "users") that are fully loaded.
+        self.loaded: set[str] = set()
+        self.loading: asyncio.Task | None = None
+        # Ids removed before their index finished loading, kept out of it.
+        self.removed: dict[str, set[int]] = defaultdict(set)
+
+        # Write-behind buffer: collection name -> pending operations, in order.
+        self.writes: dict[str, list] = defaultdict(list)
+        self.flush_now = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+        self.flusher: asyncio.Task | None = None
+
     async def connect(self) -> None:
         """Check if we can connect to the database.
 
@@ -54,15 +80,66 @@ class MongoDB:
             start = time()
             await self.mongo.admin.command("ping")
             logger.info(f"Database connection successful. ({time() - start:.2f}s)")
+            await self.create_indexes()
             await self.load_cache()
         except Exception as e:
             raise SystemExit(f"Database connection failed: {type(e).__name__}") from e
 
     async def close(self) -> None:
         """Close the connection to the database."""
+        if self.loading:
+            self.loading.cancel()
+        await self.flush()
+        if self.flusher:
+            self.flusher.cancel()
         await self.mongo.close()
         logger.info("Database connection closed.")
 
+    # WRITE-BEHIND
+    def _write(self, collection, op) -> None:
+        """
+        Queue a write instead of awaiting it. Writes are flushed in order
+        per collection, every WRITE_DELAY seconds or once WRITE_BATCH are pending.
+        """
+        self.writes[collection.name].append(op)
+        if not self.flusher or self.flusher.done():
+            self.flusher = asyncio.create_task(self._flush_loop())
+        if sum(map(len, self.writes.values())) >= config.WRITE_BATCH:
+            self.flush_now.set()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_now.wait(), config.WRITE_DELAY)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_now.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Write out everything buffered, one ordered bulk_write per collection."""
+        async with self.flush_lock:
+            writes, self.writes = self.writes, defaultdict(list)
+            for name, ops in writes.items():
+                try:
+                    await self.db[name].bulk_write(ops, ordered=True)
+                    continue
+                except BulkWriteError as e:
+                    errors = e.details.get("writeErrors") or []
+                    if not errors:
+                        # Only the write concern failed; the writes were applied.
+                        logger.warning(f"Write concern not met for {name}: {e.details}")
+                        continue
+                    # Ordered writes stop at the first error: drop that one, retry the rest.
+                    error = errors[0]
+                    logger.warning(f"Dropped write to {name}: {error.get('errmsg')}")
+                    retry = ops[error["index"] + 1 :]
+                except Exception as e:
+                    logger.warning(f"Flushing {len(ops)} writes to {name} failed: {e}")
+                    retry = ops
+                # Keep retried writes ahead of anything queued meanwhile.
+                self.writes[name][:0] = retry
+
     # CACHE
     async def get_call(self, chat_id: int) -> bool:
         return chat_id in self.active_calls
@@ -99,25 +176,45 @@ class MongoDB:
         users = await self._get_auth(chat_id)
         if user_id not in users:
             users.add(user_id)
-            await self.authdb.update_one(
-                {"_id": chat_id}, {"$addToSet": {"user_ids": user_id}}, upsert=True
+            self._write(
+                self.authdb,
+                UpdateOne(
+                    {"_id": chat_id}, {"$addToSet": {"user_ids": user_id}}, upsert=True
+                ),
             )
 
     async def rm_auth(self, chat_id: int, user_id: int) -> None:
         users = await self._get_auth(chat_id)
         if user_id in users:
             users.discard(user_id)
-            await self.authdb.update_one(
-                {"_id": chat_id}, {"$pull": {"user_ids": user_id}}
+            self._write(
+                self.authdb, UpdateOne({"_id": chat_id}, {"$pull": {"user_ids": user_id}})
             )
 
     # ASSISTANT METHODS
-    async def set_assistant(self, chat_id: int) -> int:
-        num = randint(1, len(userbot.clients))
-        await self.assistantdb.update_one(
-            {"_id": chat_id},
-            {"$set": {"num": num}},
-            upsert=True,
+    def assistant_load(self, num: int) -> int:
+        return sum(1 for chat_id in self.active_calls if self.assistant.get(chat_id) == num)
+
+    def _has_room(self, num: int) -> bool:
+        return not config.MAX_CALLS or self.assistant_load(num) < config.MAX_CALLS
+
+    async def set_assistant(self, chat_id: int) -> int | None:
+        """
+        Assign the least loaded assistant that still has room, counting
+        recent join failures against it. Returns None if all are full.
+        """
+        from anony import anon
+
+        free = [n for n in range(1, len(userbot.clients) + 1) if self._has_room(n)]
+        if not free:
+            return None
+        num = min(
+            free,
+            key=lambda n: (self.assistant_load(n) + 2 * anon.recent_failures(n), random()),
+        )
+        self._write(
+            self.assistantdb,
+            UpdateOne({"_id": chat_id}, {"$set": {"num": num}}, upsert=True),
         )
         self.assistant[chat_id] = num
         return num
@@ -128,10 +225,22 @@ class MongoDB:
         if chat_id not in self.assistant:
             doc = await self.assistantdb.find_one({"_id": chat_id})
             num = doc["num"] if doc else await self.set_assistant(chat_id)
-            self.assistant[chat_id] = num
+            # Everyone is full: keep a provisional pick, check_assistant gates new calls.
+            self.assistant[chat_id] = num or randint(1, len(userbot.clients))
 
         return anon.clients[self.assistant[chat_id] - 1]
 
+    async def check_assistant(self, chat_id: int) -> bool:
+        """
+        Make sure the chat's assistant can take another call, moving the
+        chat to a free assistant if needed. False means all are at capacity.
+        """
+        if chat_id not in self.assistant:
+            await self.get_assistant(chat_id)
+        if chat_id in self.active_calls or self._has_room(self.assistant[chat_id]):
+            return True
+        return await self.set_assistant(chat_id) is not None
+
     async def get_client(self, chat_id: int):
         if chat_id not in self.assistant:
             await self.get_assistant(chat_id)
@@ -142,62 +251,158 @@ class MongoDB:
     # BLACKLIST METHODS
     async def add_blacklist(self, chat_id: int) -> None:
         if str(chat_id).startswith("-"):
-            self.blacklisted.append(chat_id)
-            return await self.cache.update_one(
-                {"_id": "bl_chats"}, {"$addToSet": {"chat_ids": chat_id}}, upsert=True
+            self.blacklisted.add(chat_id)
+            return self._write(
+                self.cache,
+                UpdateOne(
+                    {"_id": "bl_chats"}, {"$addToSet": {"chat_ids": chat_id}}, upsert=True
+                ),
             )
-        await self.cache.update_one(
-            {"_id": "bl_users"}, {"$addToSet": {"user_ids": chat_id}}, upsert=True
+        self._write(
+            self.cache,
+            UpdateOne(
+                {"_id": "bl_users"}, {"$addToSet": {"user_ids": chat_id}}, upsert=True
+            ),
         )
 
     async def del_blacklist(self, chat_id: int) -> None:
         if str(chat_id).startswith("-"):
-            self.blacklisted.remove(chat_id)
-            return await self.cache.update_one(
-                {"_id": "bl_chats"},
-                {"$pull": {"chat_ids": chat_id}},
+            self.blacklisted.discard(chat_id)
+            return self._write(
+                self.cache, UpdateOne({"_id": "bl_chats"}, {"$pull": {"chat_ids": chat_id}})
             )
-        await self.cache.update_one(
-            {"_id": "bl_users"},
-            {"$pull": {"user_ids": chat_id}},
+        self._write(
+            self.cache, UpdateOne({"_id": "bl_users"}, {"$pull": {"user_ids": chat_id}})
         )
 
-    async def get_blacklisted(self, chat: bool = False) -> list[int]:
+    async def get_blacklisted(self, chat: bool = False) -> set[int] | list[int]:
         if chat:
             if not self.blacklisted:
                 doc = await self.cache.find_one({"_id": "bl_chats"})
-                self.blacklisted.extend(doc.get("chat_ids", []) if doc else [])
+                self.blacklisted.update(doc.get("chat_ids", []) if doc else [])
             return self.blacklisted
         doc = await self.cache.find_one({"_id": "bl_users"})
         return doc.get("user_ids", []) if doc else []
 
     # CHAT METHODS
     async def is_chat(self, chat_id: int) -> bool:
-        return chat_id in self.chats
+        if chat_id in self.chats or "chats" in self.loaded:
+            return chat_id in self.chats
+        return await self._lookup("chats", chat_id)
 
     async def add_chat(self, chat_id: int) -> None:
         if not await self.is_chat(chat_id):
-            self.chats.append(chat_id)
-            await self.chatsdb.insert_one({"_id": chat_id})
+            self.chats.add(chat_id)
+            self.removed["chats"].discard(chat_id)
+            self._write(
+                self.chatsdb, ReplaceOne({"_id": chat_id}, {"_id": chat_id}, upsert=True)
+            )
 
     async def rm_chat(self, chat_id: int) -> None:
         if await self.is_chat(chat_id):
-            self.chats.remove(chat_id)
-            await self.chatsdb.delete_one({"_id": chat_id})
+            self.chats.discard(chat_id)
+            if "chats" not in self.loaded:
+                self.removed["chats"].add(chat_id)
+            self._write(self.chatsdb, DeleteOne({"_id": chat_id}))
 
-    async def get_chats(self) -> list:
-        if not self.chats:
-            self.chats.extend([chat["_id"] async for chat in self.chatsdb.find()])
+    async def get_chats(self) -> set[int]:
+        await self._ensure_loaded("chats")
         return self.chats
 
+    async def count_chats(self) -> int:
+        if "chats" in self.loaded:
+            return len(self.chats)
+        return await self.chatsdb.estimated_document_count()
+
+    async def iter_chats(self, batch_size: int = config.LOAD_BATCH):
+        """Stream chat ids from the database without loading them all."""
+        async for chat in self.chatsdb.find({}, {"_id": 1}, batch_size=batch_size):
+            yield chat["_id"]
+
+    # JOINED CHAT METHODS
+    async def touch_chat(self, num: int, chat_id: int, joined: bool = False) -> None:
+        """
+        Record activity of assistant `num` in a chat: a play, or a join
+        when `joined` is set. Chats seen for the first time count as joined.
+        """
+        now = time()
+        chats = self.joined.setdefault(num, {})
+        data = {"played": now}
+        if joined or chat_id not in chats:
+            data["joined"] = now
+        chats.setdefault(chat_id, {}).update(data)
+        self._write(
+            self.joineddb,
+            UpdateOne(
+                {"_id": f"{num}:{chat_id}"},
+                {"$set": {"num": num, "chat_id": chat_id, **data}},
+                upsert=True,
+            ),
+        )
+
+    async def rm_joined(self, num: int, chat_id: int) -> None:
+        self.joined.get(num, {}).pop(chat_id, None)
+        self._write(self.joineddb, DeleteOne({"_id": f"{num}:{chat_id}"}))
+
+    def coldest_chats(self, num: int, limit: int, idle: int = 0) -> list[int]:
+        """
+        Up to `limit` chats of assistant `num` ordered by last activity,
+        oldest first, skipping active calls and chats used in the last `idle` seconds.
+        """
+        cutoff = time() - idle
+        entries = (
+            (max(entry.get("joined", 0), entry.get("played", 0)), chat_id)
+            for chat_id, entry in self.joined.get(num, {}).items()
+            if chat_id not in self.active_calls
+        )
+        return [
+            chat_id
+            for last, chat_id in heapq.nsmallest(limit, entries)
+            if last <= cutoff
+        ]
+
+    async def seed_joined(self, num: int, chat_ids: list[int]) -> None:
+        """
+        Index chats assistant `num` joined before the index existed,
+        as never used. Done once per assistant.
+        """
+        chats = self.joined.setdefault(num, {})
+        new = [chat_id for chat_id in chat_ids if chat_id not in chats]
+        for chat_id in new:
+            chats[chat_id] = {"joined": 0, "played": 0}
+        if new:
+            await self.joineddb.bulk_write(
+                [
+                    UpdateOne(
+                        {"_id": f"{num}:{chat_id}"},
+                        {"$setOnInsert": {"num": num, "chat_id": chat_id, "joined": 0, "played": 0}},
+                        upsert=True,
+                    )
+                    for chat_id in new
+                ],
+                ordered=False,
+            )
+        self.joined_seeded.add(num)
+        await self.cache.update_one(
+            {"_id": "joined_seeded"}, {"$addToSet": {"nums": num}}, upsert=True
+        )
+
+    async def load_joined(self) -> None:
+        doc = await self.cache.find_one({"_id": "joined_seeded"})
+        self.joined_seeded = set(doc.get("nums", []) if doc else [])
+        async for doc in self.joineddb.find():
+            self.joined.setdefault(doc["num"], {})[doc["chat_id"]] = {
+                "joined": doc.get("joined", 0),
+                "played": doc.get("played", 0),
+            }
+
     # LANGUAGE METHODS
     async def set_lang(self, chat_id: int, lang_code: str):
-        await self.langdb.update_one(
-            {"_id": chat_id},
-            {"$set": {"lang": lang_code}},
-            upsert=True,
-        )
         self.lang[chat_id] = lang_code
+        self._write(
+            self.langdb,
+            UpdateOne({"_id": chat_id}, {"$set": {"lang": lang_code}}, upsert=True),
+        )
 
     async def get_lang(self, chat_id: int) -> str:
         if chat_id not in self.lang:
@@ -217,27 +422,84 @@ class MongoDB:
 
     async def set_logger(self, status: bool) -> None:
         self.logger = status
-        await self.cache.update_one(
-            {"_id": "logger"},
-            {"$set": {"status": status}},
-            upsert=True,
+        self._write(
+            self.cache,
+            UpdateOne({"_id": "logger"}, {"$set": {"status": status}}, upsert=True),
+        )
+
+    # MEDIA METHODS
+    async def get_media(self, media_id: str) -> dict | None:
+        return self.media.get(media_id)
+
+    async def set_media(self, media_id: str, **data) -> None:
+        self.media.setdefault(media_id, {"_id": media_id}).update(data)
+        await self.mediadb.update_one(
+            {"_id": media_id}, {"$set": data}, upsert=True
+        )
+
+    async def rm_media_file(self, media_id: str) -> None:
+        """Forget the file of an entry, keeping its probed metadata."""
+        fields = ("file_path", "size", "last_used")
+        for field in fields:
+            self.media.get(media_id, {}).pop(field, None)
+        await self.mediadb.update_one(
+            {"_id": media_id}, {"$unset": {field: "" for field in fields}}
+        )
+
+    async def load_media(self) -> None:
+        from anony import storage
+
+        self.media = {doc["_id"]: doc async for doc in self.mediadb.find()}
+        storage.scan(
+            {
+                doc["file_path"]: doc["last_used"]
+                for doc in self.media.values()
+                if doc.get("file_path") and doc.get("last_used")
+            }
         )
 
     # PLAY MODE METHODS
     async def get_play_mode(self, chat_id: int) -> bool:
         if chat_id not in self.play_mode:
             doc = await self.playmodedb.find_one({"_id": chat_id})
-            if doc:
-                self.play_mode.append(chat_id)
-        return chat_id in self.play_mode
+            self.play_mode[chat_id] = doc is not None
+        return self.play_mode[chat_id]
 
     async def set_play_mode(self, chat_id: int, remove: bool = False) -> None:
-        if remove:
-            self.play_mode.remove(chat_id)
-            await self.playmodedb.delete_one({"_id": chat_id})
-        else:
-            self.play_mode.append(chat_id)
-            await self.playmodedb.insert_one({"_id": chat_id})
+        self.play_mode[chat_id] = not remove
+        self._write(
+            self.playmodedb,
+            DeleteOne({"_id": chat_id})
+            if remove
+            else ReplaceOne({"_id": chat_id}, {"_id": chat_id}, upsert=True),
+        )
+
+    # SEARCH METHODS
+    async def create_indexes(self) -> None:
+        """Expire cached searches SEARCH_CACHE_TTL seconds after they were stored."""
+        ttl = config.SEARCH_CACHE_TTL
+        try:
+            await self.searchdb.create_index("cached", expireAfterSeconds=ttl)
+        except OperationFailure:
+            # The index exists with another TTL; update it in place.
+            await self.db.command(
+                "collMod",
+                self.searchdb.name,
+                index={"keyPattern": {"cached": 1}, "expireAfterSeconds": ttl},
+            )
+
+    async def get_search(self, query: str) -> dict | None:
+        doc = await self.searchdb.find_one({"_id": query}, {"cached": 0})
+        if doc:
+            doc.pop("_id")
+        return doc
+
+    async def set_search(self, query: str, data: dict) -> None:
+        await self.searchdb.update_one(
+            {"_id": query},
+            {"$set": {**data, "cached": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
 
     # SUDO METHODS
     async def add_sudo(self, user_id: int) -> None:
@@ -256,26 +518,91 @@ class MongoDB:
 
     # USER METHODS
     async def is_user(self, user_id: int) -> bool:
-        return user_id in self.users
+        if user_id in self.users or "users" in self.loaded:
+            return user_id in self.users
+        return await self._lookup("users", user_id)
 
     async def add_user(self, user_id: int) -> None:
         if not await self.is_user(user_id):
-            self.users.append(user_id)
-            await self.usersdb.insert_one({"_id": user_id})
+            self.users.add(user_id)
+            self.removed["users"].discard(user_id)
+            self._write(
+                self.usersdb, ReplaceOne({"_id": user_id}, {"_id": user_id}, upsert=True)
+            )
 
     async def rm_user(self, user_id: int) -> None:
         if await self.is_user(user_id):
-            self.users.remove(user_id)
-            await self.usersdb.delete_one({"_id": user_id})
+            self.users.discard(user_id)
+            if "users" not in self.loaded:
+                self.removed["users"].add(user_id)
+            self._write(self.usersdb, DeleteOne({"_id": user_id}))
 
-    async def get_users(self) -> list:
-        if not self.users:
-            self.users.extend([user["_id"] async for user in self.usersdb.find()])
+    async def get_users(self) -> set[int]:
+        await self._ensure_loaded("users")
         return self.users
 
+    async def count_users(self) -> int:
+        if "users" in self.loaded:
+            return len(self.users)
+        return await self.usersdb.estimated_document_count()
+
+    async def iter_users(self, batch_size: int = config.LOAD_BATCH):
+        """Stream user ids from the database without loading them all."""
+        async for user in self.usersdb.find({}, {"_id": 1}, batch_size=batch_size):
+            yield user["_id"]
+
+    async def _lookup(self, name: str, _id: int) -> bool:
+        """
+        Point lookup while the `name` index is loading. Ids added or removed
+        since are answered from memory, as their writes may still be buffered.
+        """
+        if _id in self.removed.get(name, ()):
+            return False
+        if _id in getattr(self, name):
+            return True
+        return await self.db[name].find_one({"_id": _id}, {"_id": 1}) is not None
+
+    async def _load_ids(self, name: str) -> None:
+        """
+        Fill the `chats` or `users` index from its collection in batches,
+        reading only `_id`. Ids added meanwhile are kept and ids removed
+        meanwhile stay out, even if the cursor still returns them.
+        """
+        index, removed = getattr(self, name), self.removed[name]
+        async for doc in getattr(self, f"{name}db").find(
+            {}, {"_id": 1}, batch_size=config.LOAD_BATCH
+        ):
+            if doc["_id"] not in removed:
+                index.add(doc["_id"])
+        self.loaded.add(name)
+        self.removed.pop(name, None)
+
+    async def _ensure_loaded(self, name: str) -> None:
+        if name in self.loaded:
+            return
+        if self.loading and not self.loading.done():
+            await asyncio.shield(self.loading)
+        if name not in self.loaded:
+            await self._load_ids(name)
+
+    async def _load_index(self) -> None:
+        start = time()
+        try:
+            await asyncio.gather(self._load_ids("chats"), self._load_ids("users"))
+            logger.info(
+                f"Loaded {len(self.chats)} chats and {len(self.users)} users. ({time() - start:.2f}s)"
+            )
+        except Exception as e:
+            logger.warning(f"Loading chats and users failed: {e}")
+
     async def load_cache(self) -> None:
-        await self.get_chats()
-        await self.get_users()
+        if config.LAZY_LOAD:
+            # Membership falls back to point lookups until the index is built.
+            self.loading = asyncio.create_task(self._load_index())
+        else:
+            await asyncio.gather(self._load_ids("chats"), self._load_ids("users"))
         await self.get_blacklisted(True)
         await self.get_logger()
+        await self.load_media()
+        await self.load_joined()
         logger.info("Database cache loaded.")
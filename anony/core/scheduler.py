@@ -0,0 +1,138 @@
+# Copyright (c) 2025 AnonymousX1025
+# Licensed under the MIT License.
+# This file is part of AnonXMusic
+
+
+import asyncio
+import itertools
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Callable, Hashable
+
+from anony import config
+
+
+class Priority(IntEnum):
+    NOW_PLAYING = 0
+    FORCE = 1
+    PREFETCH = 2
+    BACKGROUND = 3
+
+
+@dataclass
+class Job:
+    priority: Priority
+    func: Callable[[], Any]
+    future: asyncio.Future
+    queued: float = field(default_factory=time.monotonic)
+    key: Hashable = None
+    started: bool = False
+
+
+class Scheduler:
+    """
+    Runs blocking yt-dlp work on a dedicated, bounded thread pool, picking
+    queued jobs by priority so prefetches can't starve a track a user is
+    waiting on.
+    """
+
+    def __init__(self):
+        self.workers = config.DOWNLOAD_WORKERS
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="ytdl"
+        )
+        self.queue: asyncio.PriorityQueue | None = None
+        self.jobs: dict[Hashable, Job] = {}
+        self.seq = itertools.count()
+        self.tasks: list[asyncio.Task] = []
+        self.done = Counter()
+        self.waits: dict[Priority, float] = {}
+
+    def _start(self) -> None:
+        if self.queue is None:
+            self.queue = asyncio.PriorityQueue()
+            self.tasks = [
+                asyncio.create_task(self._worker()) for _ in range(self.workers)
+            ]
+
+    def _push(self, job: Job) -> None:
+        self.queue.put_nowait((job.priority, next(self.seq), job))
+
+    async def run(
+        self,
+        func: Callable[[], Any],
+        priority: Priority = Priority.BACKGROUND,
+        key: Hashable = None,
+    ) -> Any:
+        """
+        Queue a blocking callable and wait for its result. Cancelling the
+        caller drops the job if no worker has picked it up yet.
+        """
+        self._start()
+        job = Job(priority, func, asyncio.get_running_loop().create_future(), key=key)
+        if key is not None:
+            self.jobs[key] = job
+        self._push(job)
+        try:
+            return await job.future
+        finally:
+            if key is not None and self.jobs.get(key) is job:
+                self.jobs.pop(key)
+
+    def bump(self, key: Hashable, priority: Priority) -> None:
+        """Raise the priority of a queued job, if it hasn't started yet."""
+        job = self.jobs.get(key)
+        if job and not job.started and priority < job.priority:
+            job.priority = priority
+            self._push(job)
+
+    def started(self, key: Hashable) -> bool:
+        """Whether the job queued under `key` has been picked up by a worker."""
+        job = self.jobs.get(key)
+        return bool(job and job.started)
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, job = await self.queue.get()
+            # Skip jobs cancelled while queued and stale entries left by bump().
+            if job.started or job.future.done():
+                continue
+
+            job.started = True
+            wait = time.monotonic() - job.queued
+            self.waits[job.priority] = 0.8 * self.waits.get(job.priority, wait) + 0.2 * wait
+            try:
+                result = await loop.run_in_executor(self.executor, job.func)
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
+            self.done[job.priority] += 1
+
+    def stats(self) -> dict:
+        """Queue depth, average wait (seconds) and completed jobs per priority."""
+        pending = {
+            id(job): job
+            for _, _, job in list(self.queue._queue if self.queue else [])
+            if not job.started and not job.future.done()
+        }
+        depth = Counter(job.priority for job in pending.values())
+        return {
+            p.name.lower(): {
+                "queued": depth[p],
+                "wait": round(self.waits.get(p, 0.0), 2),
+                "done": self.done[p],
+            }
+            for p in Priority
+        }
+
+    async def close(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,177 @@
+# Copyright (c) 2025 AnonymousX1025
+# Licensed under the MIT License.
+# This file is part of AnonXMusic
+
+
+import asyncio
+import itertools
+import time
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Callable, Hashable
+
+from pyrogram import errors
+
+from anony import config, logger
+
+
+class Lane(IntEnum):
+    REPLY = 0
+    NOW_PLAYING = 1
+    TIMER = 2
+    PROGRESS = 3
+    LOG = 4
+    BROADCAST = 5
+
+
+@dataclass
+class Job:
+    lane: Lane
+    seq: int
+    chat_id: int | None
+    func: Callable
+    args: tuple
+    kwargs: dict
+    future: asyncio.Future
+    key: Hashable = None
+    started: bool = False
+    retries: int = field(default=0)
+
+
+class Sender:
+    """
+    Central scheduler for outbound Bot API calls.
+
+    Calls are queued by lane, limited globally to SEND_RATE per second and to
+    one per second per chat, and retried after the FloodWait delay (which only
+    holds back the chat that caused it). Calls to the same method queued with
+    the same key are coalesced so only the latest one is sent.
+    """
+
+    def __init__(self):
+        self.rate = config.SEND_RATE
+        self.interval = 1.0
+        self.queue: asyncio.PriorityQueue | None = None
+        self.seq = itertools.count()
+        self.tie = itertools.count()
+        self.pending: dict[Hashable, Job] = {}
+        self.next_at: dict[int, float] = {}
+        self.sent: list[float] = []
+        self.task: asyncio.Task | None = None
+        self.limit = asyncio.Semaphore(10)
+
+    def _start(self) -> None:
+        if self.queue is None:
+            self.queue = asyncio.PriorityQueue()
+            self.task = asyncio.create_task(self._dispatch())
+
+    def _push(self, job: Job) -> None:
+        self.queue.put_nowait((job.lane, job.seq, next(self.tie), job))
+
+    def post(
+        self,
+        func: Callable,
+        *args,
+        peer: int = None,
+        lane: Lane = Lane.REPLY,
+        key: Hashable = None,
+        **kwargs,
+    ) -> asyncio.Future:
+        """
+        Queue a call and return a future for its result without waiting.
+        `peer` is the chat the call targets, for per-chat rate limiting.
+        A queued call to the same method with the same `key` is replaced by
+        this one; a different kind of edit to the same message is not.
+        """
+        self._start()
+        if key is not None:
+            key = (key, getattr(func, "__name__", func))
+        job = self.pending.get(key) if key is not None else None
+        if job and not job.started:
+            job.func, job.args, job.kwargs = func, args, kwargs
+            if lane < job.lane:
+                job.lane = lane
+                self._push(job)
+            return job.future
+
+        job = Job(
+            lane, next(self.seq), peer, func, args, kwargs,
+            asyncio.get_running_loop().create_future(), key,
+        )
+        # Fire-and-forget callers never read the result; don't warn about it.
+        job.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        if key is not None:
+            self.pending[key] = job
+        self._push(job)
+        return job.future
+
+    async def call(self, func: Callable, *args, **kwargs) -> Any:
+        """Queue a call and wait for its result."""
+        return await asyncio.shield(self.post(func, *args, **kwargs))
+
+    async def _slot(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.sent = [t for t in self.sent if t > now - 1]
+            if len(self.sent) < self.rate:
+                self.sent.append(now)
+                return
+            await asyncio.sleep(self.sent[0] + 1 - now)
+
+    async def _dispatch(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, _, job = await self.queue.get()
+            # Skip finished jobs and stale entries left by a lane bump.
+            if job.started or job.future.done():
+                continue
+
+            wait = self.next_at.get(job.chat_id, 0) - time.monotonic()
+            if job.chat_id is not None and wait > 0:
+                loop.call_later(wait, self._push, job)
+                continue
+
+            await self._slot()
+            if job.chat_id is not None:
+                self.next_at[job.chat_id] = time.monotonic() + self.interval
+            job.started = True
+            if self.pending.get(job.key) is job:
+                self.pending.pop(job.key)
+            asyncio.create_task(self._run(job))
+
+    async def _run(self, job: Job) -> None:
+        async with self.limit:
+            try:
+                result = await job.func(*job.args, **job.kwargs)
+            except errors.FloodWait as fw:
+                if job.chat_id is not None:
+                    self.next_at[job.chat_id] = time.monotonic() + fw.value
+                if job.retries < 3:
+                    logger.warning(f"FloodWait of {fw.value}s in {job.chat_id}, retrying.")
+                    job.retries += 1
+                    job.started = False
+                    if job.chat_id is None:
+                        asyncio.get_running_loop().call_later(fw.value, self._push, job)
+                    else:
+                        self._push(job)
+                    return
+                job.future.set_exception(fw)
+            except Exception as e:
+                job.future.set_exception(e)
+            else:
+                job.future.set_result(result)
+
+    def stats(self) -> dict:
+        pending = {
+            id(job): job
+            for _, _, _, job in list(self.queue._queue if self.queue else [])
+            if not job.started and not job.future.done()
+        }
+        depth = {lane.name.lower(): 0 for lane in Lane}
+        for job in pending.values():
+            depth[job.lane.name.lower()] += 1
+        return depth
+
+    async def close(self) -> None:
+        if self.task:
+            self.task.cancel()
@@ -0,0 +1,102 @@
+# Copyright (c) 2025 AnonymousX1025
+# Licensed under the MIT License.
+# This file is part of AnonXMusic
+
+
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+from anony import config, logger
+
+
+class Storage:
+    """
+    Keeps the downloads/ and cache/ directories under a byte budget by
+    evicting the least recently used files first.
+    """
+
+    def __init__(self):
+        self.dirs = ["downloads", "cache"]
+        self.limit = config.STORAGE_LIMIT * 1024 * 1024
+        self.files: OrderedDict[str, int] = OrderedDict()
+        self.size = 0
+        # The queue doesn't exist yet, so nothing can be pinned; the rescan
+        # in db.load_media() does the boot eviction.
+        self.scan(evict=False)
+
+    def scan(self, last_used: dict[str, float] = None, evict: bool = True) -> None:
+        """
+        Rebuild the LRU index from the files currently on disk, ordered by
+        their recorded last use (or modification time if unknown).
+        """
+        last_used = last_used or {}
+        found = []
+        for _dir in self.dirs:
+            for file in Path(_dir).iterdir():
+                if file.is_file() and not self._partial(file.name):
+                    stat = file.stat()
+                    used = last_used.get(str(file), stat.st_mtime)
+                    found.append((used, str(file), stat.st_size))
+
+        self.files.clear()
+        for _, path, size in sorted(found):
+            self.files[path] = size
+        self.size = sum(self.files.values())
+        logger.info(
+            f"Storage index loaded: {len(self.files)} files, {self.size / 1024**2:.2f} MB."
+        )
+        if evict:
+            self.evict()
+
+    def _partial(self, name: str) -> bool:
+        return name.startswith("temp_") or name.endswith((".part", ".ytdl", ".pipe"))
+
+    def _pinned(self) -> set[str]:
+        """Files referenced by any queued or currently streaming item."""
+        from anony import queue
+
+        pinned = set()
+        for items in list(queue.queues.values()):
+            for item in items:
+                if item.file_path:
+                    pinned.add(os.path.normpath(item.file_path))
+                pinned.add(f"cache{os.sep}{item.id}.png")
+        return pinned
+
+    def valid(self, entry: dict) -> bool:
+        """Check that an indexed file is still on disk with its recorded size."""
+        path = entry.get("file_path")
+        if not path or not os.path.isfile(path):
+            return False
+        return not entry.get("size") or os.path.getsize(path) == entry["size"]
+
+    def use(self, path: str | None) -> None:
+        """Mark a file as recently used, indexing it if it is new."""
+        if not path or not os.path.isfile(path):
+            return
+        path = os.path.normpath(path)
+        size = os.path.getsize(path)
+        self.size += size - self.files.pop(path, 0)
+        self.files[path] = size
+        self.evict(keep=path)
+
+    def evict(self, keep: str = None) -> None:
+        """Remove least recently used, unpinned files until under budget."""
+        if self.size <= self.limit:
+            return
+
+        pinned = self._pinned()
+        for path in list(self.files):
+            if self.size <= self.limit:
+                break
+            if path == keep or path in pinned:
+                continue
+            size = self.files.pop(path)
+            self.size -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Failed to evict {path}: {e}")
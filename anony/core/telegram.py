@@ -4,17 +4,28 @@
 
 
 import asyncio
+import errno
+import itertools
 import os
+import threading
 import time
 
 from pyrogram import types
 
+from anony import app, bandwidth, config, db, logger, sender, storage, userbot
+from anony.core.scheduler import Priority
+from anony.core.sender import Lane
 from anony.helpers import Media, buttons, utils
 
 
 class Telegram:
     def __init__(self):
-        self.active = []
+        self.downloading: dict[str, asyncio.Task] = {}
+        self.waiters: dict[str, dict[int, types.Message]] = {}
+        self.ready: dict[str, asyncio.Event] = {}
+        self.streaming: set[str] = set()
+        self.finished: dict[str, threading.Event] = {}
+        self.pipe_ids = itertools.count()
         self.events = {}
         self.last_edit = {}
         self.active_tasks = {}
@@ -23,7 +34,252 @@ class Telegram:
     def get_media(self, msg: types.Message) -> bool:
         return any([msg.video, msg.audio, msg.document, msg.voice])
 
+    def partial(self, file_path: str) -> str | None:
+        """
+        If `file_path` is still being streamed in, return a named pipe that
+        replays it from the start and is closed once the download ends, so
+        ffmpeg gets a real EOF instead of waiting on a growing file.
+        """
+        finished = self.finished.get(file_path)
+        if file_path not in self.streaming or not finished or os.path.exists(file_path):
+            return None
+        # Opened now: the reader keeps it across the rename to `file_path`.
+        source = open(f"{file_path}.part", "rb")
+        fifo = f"{file_path}.{next(self.pipe_ids)}.pipe"
+        os.mkfifo(fifo)
+        # Its own thread: it can block for the whole download and must not
+        # hold a slot of the default executor the rest of the bot shares.
+        threading.Thread(
+            target=self._feed, args=(source, fifo, finished), daemon=True
+        ).start()
+        return fifo
+
+    def _feed(self, source, fifo: str, finished: threading.Event, timeout: float = 60) -> None:
+        """Copy the growing file into `fifo` until the download has finished."""
+        try:
+            # Wait for ffmpeg to open the read end, but not forever.
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    fd = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+                    break
+                except OSError as e:
+                    if e.errno != errno.ENXIO or time.monotonic() > deadline:
+                        return
+                    time.sleep(0.1)
+            os.set_blocking(fd, True)
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    # Checked before reading, so the tail written last isn't missed.
+                    done = finished.is_set()
+                    data = source.read(256 * 1024)
+                    if data:
+                        out.write(data)
+                    elif done:
+                        break
+                    else:
+                        finished.wait(0.2)
+        except OSError:
+            pass  # ffmpeg went away (skip, stop, seek)
+        finally:
+            source.close()
+            if os.path.exists(fifo):
+                os.remove(fifo)
+
+    def _index_at_end(self, head: bytes) -> bool:
+        """True for MP4/MOV files whose moov atom isn't ahead of the media data."""
+        if head[4:8] != b"ftyp":
+            return False
+        pos = 0
+        while pos + 8 <= len(head):
+            size = int.from_bytes(head[pos : pos + 4], "big")
+            kind = head[pos + 4 : pos + 8]
+            if kind == b"moov":
+                return False
+            if kind == b"mdat":
+                return True
+            if size == 1:
+                size = int.from_bytes(head[pos + 8 : pos + 16], "big")
+            if size < 8:
+                break
+            pos += size
+        return True
+
+    async def _progress(self, file_id: str, start_time: float, current: int, total: int):
+        """Queue a progress edit for every message waiting on this file."""
+        now = time.time()
+        speed = current / (now - start_time or 1e-6)
+        for msg_id, sent in list(self.waiters.get(file_id, {}).items()):
+            event = self.events.get(msg_id)
+            if (event and event.is_set()) or now - self.last_edit.get(msg_id, 0) < self.sleep:
+                continue
+
+            self.last_edit[msg_id] = now
+            text = sent.lang["dl_progress"].format(
+                utils.format_size(current),
+                utils.format_size(total),
+                current * 100 / total,
+                utils.format_size(speed),
+                utils.format_eta(int((total - current) / speed)),
+            )
+            sender.post(
+                sent.edit_text,
+                text,
+                reply_markup=buttons.cancel_dl(sent.lang["cancel"]),
+                peer=sent.chat.id,
+                lane=Lane.PROGRESS,
+                key=("edit", sent.chat.id, msg_id),
+            )
+
+    async def _download(self, msg: types.Message, file_id: str, file_path: str) -> str:
+        start_time = time.time()
+        received = 0
+
+        async def progress(current, total):
+            nonlocal received
+            await bandwidth.aconsume(current - received, Priority.NOW_PLAYING)
+            received = current
+            await self._progress(file_id, start_time, current, total)
+
+        media = msg.audio or msg.voice or msg.video or msg.document
+        size = getattr(media, "file_size", 0)
+        duration = getattr(media, "duration", 0)
+        if config.TG_STREAM and duration and size:
+            if await self._progressive_download(msg, file_id, file_path, size, duration, progress):
+                return file_path
+            received = 0
+
+        if userbot.clients and size >= config.PARALLEL_DL_SIZE * 1024 * 1024:
+            try:
+                return await self._parallel_download(msg, file_path, size, progress)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Parallel download of {file_id} failed, retrying with the bot: {e}")
+                received = 0
+
+        await msg.download(file_name=file_path, progress=progress)
+        return file_path
+
+    async def _progressive_download(
+        self, msg: types.Message, file_id: str, file_path: str, size: int, duration: int, progress
+    ) -> bool:
+        """
+        Stream the file sequentially into `<file_path>.part` and signal the
+        waiters once TG_STREAM_BUFFER seconds of media are on disk, so playback
+        can follow the writer. Returns False without writing anything if the
+        container keeps its index at the end.
+        """
+        buffer = size * config.TG_STREAM_BUFFER // duration
+        ready = self.ready.setdefault(file_id, asyncio.Event())
+        finished = self.finished[file_path] = threading.Event()
+        temp = f"{file_path}.part"
+        done = 0
+
+        try:
+            with open(temp, "wb") as f:
+                async for data in app.stream_media(msg):
+                    if not done and self._index_at_end(data):
+                        return False
+                    f.write(data)
+                    f.flush()
+                    done += len(data)
+                    if done >= buffer and not ready.is_set():
+                        self.streaming.add(file_path)
+                        ready.set()
+                    await progress(done, size)
+            # Pipe feeders keep their open handle across the rename.
+            os.replace(temp, file_path)
+        finally:
+            # Ends the pipes; on failure playback stops at what was received.
+            finished.set()
+            self.finished.pop(file_path, None)
+            self.streaming.discard(file_path)
+            if os.path.exists(temp):
+                os.remove(temp)
+
+        storage.use(file_path)
+        await db.set_media(
+            file_id,
+            file_path=file_path,
+            size=os.path.getsize(file_path),
+            duration=duration,
+            last_used=time.time(),
+        )
+        return True
+
+    async def _parallel_download(
+        self, msg: types.Message, file_path: str, size: int, progress
+    ) -> str:
+        """
+        Fetch a large file as 1 MB chunk ranges spread across the bot and every
+        assistant that can see the message, writing each range in place.
+        Pyrogram opens media sessions on the file's DC for each client.
+        """
+        sources = [(app, msg)]
+        for ub in userbot.clients:
+            try:
+                ub_msg = await ub.get_messages(msg.chat.id, msg.id)
+                if ub_msg and not ub_msg.empty:
+                    sources.append((ub, ub_msg))
+            except Exception:
+                continue
+
+        chunk = 1024 * 1024
+        chunks = -(-size // chunk)
+        span = config.PARALLEL_DL_RANGE
+        ranges = asyncio.Queue()
+        for start in range(0, chunks, span):
+            ranges.put_nowait((start, min(span, chunks - start)))
+
+        temp = f"{file_path}.part"
+        fd = os.open(temp, os.O_RDWR | os.O_CREAT | os.O_TRUNC)
+        os.ftruncate(fd, size)
+        done = 0
+
+        async def worker(client, message):
+            nonlocal done
+            while not ranges.empty():
+                start, limit = ranges.get_nowait()
+                offset = start * chunk
+                try:
+                    async for data in client.stream_media(message, offset=start, limit=limit):
+                        os.pwrite(fd, data, offset)
+                        offset += len(data)
+                        done += len(data)
+                        await progress(done, size)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # Hand the range to the remaining clients and retire this one.
+                    done -= offset - start * chunk
+                    ranges.put_nowait((start, limit))
+                    logger.warning(f"Chunk range {start} failed on {client.name}: {e}")
+                    return
+
+        try:
+            await asyncio.gather(*(worker(c, m) for c, m in sources))
+            if not ranges.empty():
+                # Ranges re-queued after the other workers finished.
+                await worker(app, msg)
+            if not ranges.empty() or done < size:
+                raise RuntimeError("not every chunk range could be downloaded")
+            os.close(fd)
+            fd = None
+            os.replace(temp, file_path)
+            return file_path
+        finally:
+            if fd is not None:
+                os.close(fd)
+                if os.path.exists(temp):
+                    os.remove(temp)
+
     async def download(self, msg: types.Message, sent: types.Message) -> Media | None:
+        """
+        Download the replied media, or wait on an in-flight download of the
+        same file. Each requester keeps its own progress message, and
+        cancelling only stops waiting unless nobody else is waiting either.
+        """
         msg_id = sent.id
         event = asyncio.Event()
         self.events[msg_id] = event
@@ -42,48 +298,57 @@ class Telegram:
             await sent.edit_text(sent.lang["dl_limit"])
             return await sent.stop_propagation()
 
-        async def progress(current, total):
-            if event.is_set():
-                return
+        task = None
+        try:
+            file_path = f"downloads/{file_id}.{file_ext}"
+            entry = await db.get_media(file_id)
+            if (
+                entry
+                and entry.get("file_path")
+                and not storage.valid(entry)
+                and file_id not in self.downloading
+            ):
+                await db.rm_media_file(file_id)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
 
-            now = time.time()
-            if now - self.last_edit[msg_id] < self.sleep:
-                return
+            if not os.path.exists(file_path):
+                task = self.downloading.get(file_id)
+                if task is None:
+                    task = asyncio.create_task(self._download(msg, file_id, file_path))
+                    self.downloading[file_id] = task
 
-            self.last_edit[msg_id] = now
-            percent = current * 100 / total
-            speed = current / (now - start_time or 1e-6)
-            eta = utils.format_eta(int((total - current) / speed))
-            text = sent.lang["dl_progress"].format(
-                utils.format_size(current),
-                utils.format_size(total),
-                percent,
-                utils.format_size(speed),
-                eta,
-            )
+                    def _done(_):
+                        self.downloading.pop(file_id, None)
+                        self.waiters.pop(file_id, None)
+                        self.ready.pop(file_id, None)
 
-            await sent.edit_text(
-                text, reply_markup=buttons.cancel_dl(sent.lang["cancel"])
-            )
+                    task.add_done_callback(_done)
 
-        try:
-            file_path = f"downloads/{file_id}.{file_ext}"
-            if not os.path.exists(file_path):
-                if file_id in self.active:
-                    await sent.edit_text(sent.lang["dl_active"])
-                    return await sent.stop_propagation()
+                self.waiters.setdefault(file_id, {})[msg_id] = sent
+                ready = self.ready.setdefault(file_id, asyncio.Event())
+                waiter = asyncio.ensure_future(self._wait(task, ready))
+                self.active_tasks[msg_id] = waiter
+                await waiter
 
-                self.active.append(file_id)
-                task = asyncio.create_task(
-                    msg.download(file_name=file_path, progress=progress)
+            if os.path.exists(file_path):
+                storage.use(file_path)
+                await db.set_media(
+                    file_id,
+                    file_path=file_path,
+                    size=os.path.getsize(file_path),
+                    duration=duration,
+                    mime_type=getattr(media, "mime_type", None),
+                    title=file_title,
+                    last_used=time.time(),
                 )
-                self.active_tasks[msg_id] = task
-                await task
-                self.active.remove(file_id)
-                self.active_tasks.pop(msg_id, None)
 
-            await sent.edit_text(
-                sent.lang["dl_complete"].format(round(time.time() - start_time, 2))
+            # Same key as the progress edits, so a queued one can't land after this.
+            await sender.call(
+                sent.edit_text,
+                sent.lang["dl_complete"].format(round(time.time() - start_time, 2)),
+                peer=sent.chat.id,
+                key=("edit", sent.chat.id, msg_id),
             )
             return Media(
                 id=file_id,
@@ -100,7 +365,26 @@ class Telegram:
         finally:
             self.events.pop(msg_id, None)
             self.last_edit.pop(msg_id, None)
-            self.active = [f for f in self.active if f != file_id]
+            self.active_tasks.pop(msg_id, None)
+            waiters = self.waiters.get(file_id)
+            if waiters is not None:
+                waiters.pop(msg_id, None)
+                # A progressive download keeps going after its waiters start playing.
+                if not waiters and task and not task.done() and file_path not in self.streaming:
+                    task.cancel()
+
+    async def _wait(self, task: asyncio.Task, ready: asyncio.Event) -> None:
+        """
+        Wait until the download finishes or, when streaming, has buffered
+        enough to start playing. Cancelling this leaves `task` running.
+        """
+        buffered = asyncio.ensure_future(ready.wait())
+        try:
+            await asyncio.wait([task, buffered], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            buffered.cancel()
+        if task.done():
+            task.result()
 
     async def cancel(self, query: types.CallbackQuery):
         event = self.events.get(query.message.id)
@@ -111,8 +395,12 @@ class Telegram:
         if task and not task.done():
             task.cancel()
         if event or task:
-            await query.edit_message_text(
-                query.lang["dl_cancel"].format(query.from_user.mention)
+            # Same key as the progress edits, so a queued one can't overwrite this.
+            await sender.call(
+                query.message.edit_text,
+                query.lang["dl_cancel"].format(query.from_user.mention),
+                peer=query.message.chat.id,
+                key=("edit", query.message.chat.id, query.message.id),
             )
         else:
             await query.answer(query.lang["dl_not_found"], show_alert=True)
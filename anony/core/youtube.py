@@ -5,34 +5,91 @@
 
 import os
 import re
-import random
+import time
 import asyncio
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import contextmanager
 from pathlib import Path
+from urllib.parse import parse_qs, urlparse
 from typing import Optional, Union
 
 import yt_dlp
 from py_yt import VideosSearch
 from pyrogram import enums, types
 
+from anony import bandwidth, config, db, scheduler, storage
+from anony.core.cookies import CookiePool
+from anony.core.scheduler import Priority
 from anony.helpers import Track, utils
 
 
 class YouTube:
     def __init__(self):
         self.base = "https://www.youtube.com/watch?v="
-        self.cookies = []
-        self.checked = False
+        self.cookies = CookiePool()
+        self.ydls: dict[tuple[str, str], list[yt_dlp.YoutubeDL]] = defaultdict(list)
+        self.ydl_lock = threading.Lock()
+        self.local = threading.local()
+        self.downloading: dict[tuple[str, bool], asyncio.Task] = {}
+        self.waiters = Counter()
+        self.priorities: dict[tuple[str, bool], Priority] = {}
+        self.streams: dict[tuple[str, bool], tuple[str, dict, float]] = {}
+        self.rungs = Counter()
+        self.searches: OrderedDict[str, dict] = OrderedDict()
+        self.search_stats = Counter()
+        self.audio_exts = ["opus", "m4a", "webm", "ogg", "mp3", "aac"]
+        # Fallback order, resolved by yt-dlp in a single extraction.
+        self.audio_format = "bestaudio[acodec=opus]/bestaudio[ext=m4a]/bestaudio/worst"
+        self.reconnect = "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
         self.regex = r"(https?://)?(www\.|m\.)?(youtube\.com/(watch\?v=|shorts/)|youtu\.be/)([a-zA-Z0-9_-]{11})"
 
-    def get_cookies(self):
-        if not self.checked:
-            for file in os.listdir("anony/cookies"):
-                if file.endswith(".txt"):
-                    self.cookies.append(file)
-            self.checked = True
-        if not self.cookies:
-            return None
-        return f"anony/cookies/{random.choice(self.cookies)}"
+    @contextmanager
+    def _ydl(self, profile: str, opts: dict, cookie: str | None):
+        """
+        Check out a long-lived YoutubeDL instance for an option profile and
+        cookie file, creating one if none is idle. Instances aren't thread-safe,
+        so each is used by one worker at a time.
+        """
+        key = (profile, cookie)
+        with self.ydl_lock:
+            ydl = self.ydls[key].pop() if self.ydls[key] else None
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(
+                {**opts, "cookiefile": cookie, "progress_hooks": [self._throttle]}
+            )
+        try:
+            yield ydl
+        finally:
+            if cookie:
+                # What `with YoutubeDL()` did on exit: write rotated session
+                # cookies back to the file.
+                try:
+                    ydl.save_cookies()
+                except Exception:
+                    pass
+            with self.ydl_lock:
+                self.ydls[key].append(ydl)
+
+    def close(self) -> None:
+        """Close the pooled YoutubeDL instances, saving their cookies."""
+        with self.ydl_lock:
+            ydls = [ydl for pool in self.ydls.values() for ydl in pool]
+            self.ydls.clear()
+        for ydl in ydls:
+            try:
+                ydl.close()
+            except Exception:
+                pass
+
+    def _throttle(self, d: dict) -> None:
+        """yt-dlp progress hook: draw downloaded bytes from the bandwidth governor."""
+        if d.get("status") != "downloading":
+            return
+        done = d.get("downloaded_bytes") or 0
+        last = self.local.progress.get(d.get("filename"), 0)
+        self.local.progress[d.get("filename")] = done
+        bandwidth.consume(done - last, self.local.priority)
 
     def valid(self, url: str) -> bool:
         return bool(re.match(self.regex, url))
@@ -58,30 +115,204 @@ class YouTube:
         return None
 
     async def search(self, query: str, m_id: int, video: bool = False) -> Track | None:
+        """
+        Resolve a query to a Track, going through the in-memory LRU and the
+        persistent search cache before scraping YouTube.
+        """
+        key = self._search_key(query)
+        data = self.searches.get(key)
+        if data and data["time"] > time.time() - config.SEARCH_CACHE_TTL:
+            self.searches.move_to_end(key)
+            self.search_stats["hits"] += 1
+        else:
+            data = await db.get_search(key)
+            if data and data["time"] > time.time() - config.SEARCH_CACHE_TTL:
+                self.search_stats["db_hits"] += 1
+            else:
+                self.search_stats["misses"] += 1
+                data = await self._search(query)
+                if not data:
+                    return None
+                await db.set_search(key, data)
+                if not await db.get_media(data["id"]):
+                    await db.set_media(
+                        data["id"], title=data["title"], duration=data["duration_sec"]
+                    )
+
+            self.searches[key] = data
+            if len(self.searches) > 1000:
+                self.searches.popitem(last=False)
+
+        return Track(
+            **{k: v for k, v in data.items() if k != "time"},
+            message_id=m_id,
+            video=video,
+        )
+
+    def _search_key(self, query: str) -> str:
+        # Video ids are case-sensitive; only free-text queries are normalized.
+        if match := re.match(self.regex, query.strip()):
+            return f"video:{match.group(5)}"
+        return " ".join(query.lower().split())
+
+    async def _search(self, query: str) -> dict | None:
         _search = VideosSearch(query, limit=1)
         results = await _search.next()
         if results and results["result"]:
             data = results["result"][0]
-            return Track(
+            return dict(
                 id=data.get("id"),
                 channel_name=data.get("channel", {}).get("name"),
                 duration=data.get("duration"),
                 duration_sec=utils.to_seconds(data.get("duration")),
-                message_id=m_id,
                 title=data.get("title")[:25],
                 thumbnail=data.get("thumbnails", [{}])[-1].get("url").split("?")[0],
                 url=data.get("link"),
                 view_count=data.get("viewCount", {}).get("short"),
-                video=video,
+                time=time.time(),
             )
         return None
 
-    async def download(self, video_id: str, video: bool = False) -> Optional[str]:
+    async def stream(
+        self, video_id: str, video: bool = False, priority: Priority = Priority.NOW_PLAYING
+    ) -> Optional[tuple[str, dict]]:
+        """
+        Resolve the direct media URL and HTTP headers for a video without
+        downloading it. Results are cached until shortly before the URL expires.
+        Returns None if no single playable URL could be resolved.
+        """
+        key = (video_id, video)
+        cached = self.streams.get(key)
+        if cached and cached[2] > time.time():
+            return cached[0], cached[1]
+
+        ydl_opts = {
+            "quiet": True,
+            "noplaylist": True,
+            "geo_bypass": True,
+            "no_warnings": True,
+            "nocheckcertificate": True,
+            "format": "best[height<=?720][width<=?1280]" if video else "bestaudio/best",
+        }
+
+        profile = "stream:video" if video else "stream:audio"
+
+        def _extract(lease):
+            lease.started = time.monotonic()
+            with self._ydl(profile, ydl_opts, lease.path) as ydl:
+                info = ydl.extract_info(self.base + video_id, download=False)
+            lease.ok = bool(info)
+            return info
+
+        try:
+            # Wait for a cookie here, not on a worker thread.
+            async with self.cookies.lease(priority) as lease:
+                info = await scheduler.run(
+                    lambda: _extract(lease), priority, key=("stream", *key)
+                )
+        except Exception:
+            return None
+        if not info or not info.get("url"):
+            return None
+
+        url, headers = info["url"], info.get("http_headers", {})
+        expire = parse_qs(urlparse(url).query).get("expire", [0])[0]
+        expires = int(expire) - 60 if str(expire).isdigit() else time.time() + 3600
+        if len(self.streams) > 1000:
+            now = time.time()
+            self.streams = {k: v for k, v in self.streams.items() if v[2] > now}
+        self.streams[key] = (url, headers, expires)
+        return url, headers
+
+    async def download(
+        self, video_id: str, video: bool = False, priority: Priority = Priority.NOW_PLAYING
+    ) -> Optional[str]:
+        """
+        Download a video (or its audio) and return the file path.
+
+        Concurrent calls for the same (video_id, video) pair share a single
+        in-flight download; every caller gets the same path or the same error.
+        A later caller with a higher priority bumps the queued job. Once every
+        caller has been cancelled the job is dropped if it is still queued; a
+        running yt-dlp job can't be stopped, so it finishes and stays joinable.
+        """
+        key = (video_id, video)
+        task = self.downloading.get(key)
+        if task is None:
+            task = asyncio.create_task(self._download(video_id, video, priority))
+            self.downloading[key] = task
+
+            def _done(done: asyncio.Task):
+                if self.downloading.get(key) is done:
+                    self.downloading.pop(key)
+                    self.waiters.pop(key, None)
+                    self.priorities.pop(key, None)
+
+            task.add_done_callback(_done)
+        else:
+            # Also covers a job not queued yet because it is waiting for a cookie.
+            self.priorities[key] = min(self.priorities.get(key, priority), priority)
+            self.cookies.bump(("download", *key), priority)
+            scheduler.bump(("download", *key), priority)
+
+        self.waiters[key] += 1
+        try:
+            # Shield so that one cancelled waiter doesn't abort the shared download.
+            return await asyncio.shield(task)
+        finally:
+            if self.downloading.get(key) is task:
+                self.waiters[key] -= 1
+                if (
+                    not self.waiters[key]
+                    and not task.done()
+                    and not scheduler.started(("download", *key))
+                ):
+                    # Unregister first so a new caller starts afresh instead
+                    # of joining the cancelled task.
+                    self.downloading.pop(key)
+                    self.waiters.pop(key)
+                    self.priorities.pop(key, None)
+                    task.cancel()
+
+    def _cached(self, video_id: str, video: bool) -> Optional[str]:
+        exts = ["mp4"] if video else self.audio_exts
+        for ext in exts:
+            filename = f"downloads/{video_id}.{ext}"
+            if Path(filename).exists():
+                return filename
+        return None
+
+    def _rung(self, info: dict) -> str:
+        if info.get("vcodec") not in (None, "none"):
+            return "muxed"
+        if (info.get("acodec") or "").startswith("opus"):
+            return "opus"
+        if info.get("ext") == "m4a":
+            return "m4a"
+        return "audio"
+
+    async def _download(
+        self, video_id: str, video: bool = False, priority: Priority = Priority.NOW_PLAYING
+    ) -> Optional[str]:
         url = self.base + video_id
-        ext = "mp4" if video else "m4a"
-        filename = f"downloads/{video_id}.{ext}"
+        media_id = f"{video_id}:video" if video else video_id
+
+        entry = await db.get_media(media_id)
+        if entry and entry.get("file_path"):
+            if storage.valid(entry):
+                storage.use(entry["file_path"])
+                await db.set_media(media_id, last_used=time.time())
+                return entry["file_path"]
+            await db.rm_media_file(media_id)
 
-        if Path(filename).exists():
+        if filename := self._cached(video_id, video):
+            storage.use(filename)
+            await db.set_media(
+                media_id,
+                file_path=filename,
+                size=os.path.getsize(filename),
+                last_used=time.time(),
+            )
             return filename
 
         base_opts = {
@@ -93,28 +324,58 @@ class YouTube:
             "overwrites": False,
             "ignoreerrors": True,
             "nocheckcertificate": True,
-            "cookiefile": self.get_cookies(),
         }
 
         if video:
-            ydl_opts = {
-                **base_opts,
+            profile, opts = "video", {
                 "format": "(bestvideo[height<=?720][width<=?1280][ext=mp4])+(bestaudio)",
                 "merge_output_format": "mp4",
             }
         else:
-            ydl_opts = {
-                **base_opts,
-                "format": "worst", #"bestaudio[ext=webm][acodec=opus]",  Temporary fix for audio downloads
+            # "best" copies the audio stream out of muxed or non-native
+            # containers instead of re-encoding it.
+            profile, opts = "audio", {
+                "format": self.audio_format,
                 "postprocessors": [{
                     "key": "FFmpegExtractAudio",
-                    "preferredcodec": "m4a",
+                    "preferredcodec": "best",
                 }],
             }
 
-        def _download():
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-            return filename
+        def _download(lease):
+            self.local.priority, self.local.progress = priority, {}
+            lease.started = time.monotonic()
+            with self._ydl(profile, {**base_opts, **opts}, lease.path) as ydl:
+                info = ydl.extract_info(url, download=True)
+            if not info:
+                return None, None, None
+            downloads = info.get("requested_downloads") or [{}]
+            filename = downloads[0].get("filepath") or self._cached(video_id, video)
+            if filename and Path(filename).exists():
+                lease.ok = True
+                return filename, "video" if video else self._rung(info), info
+            return None, None, None
 
-        return await asyncio.to_thread(_download)
+        # Wait for a cookie here, not on a worker thread.
+        key = ("download", video_id, video)
+        async with self.cookies.lease(priority, key=key) as lease:
+            priority = min(priority, self.priorities.get((video_id, video), priority))
+            filename, rung, info = await scheduler.run(
+                lambda: _download(lease), priority, key=key
+            )
+        if not filename:
+            return None
+        self.rungs[rung] += 1
+        storage.use(filename)
+        await db.set_media(
+            media_id,
+            file_path=filename,
+            size=os.path.getsize(filename),
+            format=rung,
+            acodec=info.get("acodec"),
+            vcodec=info.get("vcodec"),
+            duration=info.get("duration"),
+            title=info.get("title"),
+            last_used=time.time(),
+        )
+        return filename
@@ -4,10 +4,45 @@
 
 
 from dataclasses import dataclass
+from time import monotonic
+
+
+class Playback:
+    """
+    Playback position derived from a monotonic start timestamp and the
+    pause intervals, instead of a counter ticked every second.
+    """
+
+    started: float
+    paused_at: float
+
+    @property
+    def time(self) -> int:
+        """Seconds played so far."""
+        if not self.started:
+            return 0
+        return int((self.paused_at or monotonic()) - self.started)
+
+    @time.setter
+    def time(self, position: int) -> None:
+        self.started = (self.paused_at or monotonic()) - position
+
+    def start(self, position: int = 0) -> None:
+        self.paused_at = 0.0
+        self.started = monotonic() - position
+
+    def pause(self) -> None:
+        if not self.paused_at:
+            self.paused_at = monotonic()
+
+    def resume(self) -> None:
+        if self.paused_at:
+            self.started += monotonic() - self.paused_at
+            self.paused_at = 0.0
 
 
 @dataclass
-class Media:
+class Media(Playback):
     id: str
     duration: str
     duration_sec: int
@@ -15,14 +50,15 @@ class Media:
     message_id: int
     title: str
     url: str
-    time: int = 0
     user: str = None
     video: bool = False
     playing: bool = False
+    started: float = 0.0
+    paused_at: float = 0.0
 
 
 @dataclass
-class Track:
+class Track(Playback):
     id: str
     channel_name: str
     duration: str
@@ -32,8 +68,9 @@ class Track:
     file_path: str = None
     message_id: int = 0
     playing: bool = False
-    time: int = 0
     thumbnail: str = None
     user: str = None
     view_count: str = None
     video: bool = False
+    started: float = 0.0
+    paused_at: float = 0.0
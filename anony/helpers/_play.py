@@ -43,6 +43,8 @@ def checkUB(play):
                 return await m.reply_text(m.lang["play_admin"])
 
         if m.chat.id not in db.active_calls:
+            if not await db.check_assistant(m.chat.id):
+                return await m.reply_text(m.lang["play_busy"])
             client = await db.get_client(m.chat.id)
             try:
                 member = await app.get_chat_member(m.chat.id, client.id)
@@ -104,6 +106,7 @@ def checkUB(play):
 
                 await umm.delete()
                 await client.resolve_peer(m.chat.id)
+                await db.touch_chat(db.assistant[m.chat.id], m.chat.id, joined=True)
 
         try:
             await m.delete()
@@ -8,7 +8,7 @@ import aiohttp
 from PIL import (Image, ImageDraw, ImageEnhance,
                  ImageFilter, ImageFont, ImageOps)
 
-from anony import config
+from anony import config, storage
 from anony.helpers import Track
 
 
@@ -31,6 +31,7 @@ class Thumbnail:
             temp = f"cache/temp_{song.id}.jpg"
             output = f"cache/{song.id}.png"
             if os.path.exists(output):
+                storage.use(output)
                 return output
 
             await self.save_thumb(temp, song.thumbnail)
@@ -52,6 +53,7 @@ class Thumbnail:
 
             image.save(output)
             os.remove(temp)
+            storage.use(output)
             return output
         except:
             config.DEFAULT_THUMB
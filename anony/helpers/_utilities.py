@@ -7,7 +7,8 @@ import re
 
 from pyrogram import enums, types
 
-from anony import app
+from anony import app, sender
+from anony.core.sender import Lane
 
 
 class Utilities:
@@ -75,26 +76,26 @@ class Utilities:
             title,
             duration,
         )
-        await app.send_message(chat_id=app.logger, text=_text)
+        sender.post(
+            app.send_message, chat_id=app.logger, text=_text, peer=app.logger, lane=Lane.LOG
+        )
 
     async def send_log(self, m: types.Message, chat: bool = False) -> None:
         if chat:
             user = m.from_user
-            return await app.send_message(
-                chat_id=app.logger,
-                text=m.lang["log_chat"].format(
-                    m.chat.id,
-                    m.chat.title,
-                    user.id if user else 0,
-                    user.mention if user else "Anonymous",
-                ),
+            text = m.lang["log_chat"].format(
+                m.chat.id,
+                m.chat.title,
+                user.id if user else 0,
+                user.mention if user else "Anonymous",
             )
-
-        await app.send_message(
-            chat_id=app.logger,
-            text=m.lang["log_user"].format(
+        else:
+            text = m.lang["log_user"].format(
                 m.from_user.id,
                 f"@{m.from_user.username}",
                 m.from_user.mention,
-            ),
+            )
+
+        sender.post(
+            app.send_message, chat_id=app.logger, text=text, peer=app.logger, lane=Lane.LOG
         )
@@ -7,7 +7,8 @@ import asyncio
 
 from pyrogram import errors, filters, types
 
-from anony import app, db, lang
+from anony import app, db, lang, sender
+from anony.core.sender import Lane
 
 
 broadcasting = False
@@ -24,15 +25,18 @@ async def _broadcast(_, message: types.Message):
 
     msg = message.reply_to_message
     count, ucount = 0, 0
-    chats, groups, users = [], [], []
     sent = await message.reply_text(message.lang["gcast_start"])
 
-    if "-nochat" not in message.command:
-        groups.extend(await db.get_chats())
-    if "-user" in message.command:
-        users.extend(await db.get_users())
+    async def targets():
+        # Stream ids from the database instead of holding every id in memory;
+        # small batches keep the cursor from idling out between fetches.
+        if "-nochat" not in message.command:
+            async for chat in db.iter_chats(batch_size=200):
+                yield chat, True
+        if "-user" in message.command:
+            async for user in db.iter_users(batch_size=200):
+                yield user, False
 
-    chats.extend(groups + users)
     broadcasting = True
 
     await msg.forward(app.logger)
@@ -46,18 +50,21 @@ async def _broadcast(_, message: types.Message):
     )).pin(disable_notification=False)
     await asyncio.sleep(5)
 
-    for chat in chats:
+    async for chat, group in targets():
         if not broadcasting:
             await sent.edit_text(message.lang["gcast_stopped"].format(count, ucount))
             break
 
         try:
             (
-                await msg.copy(chat, reply_markup=msg.reply_markup)
+                await sender.call(
+                    msg.copy, chat, reply_markup=msg.reply_markup,
+                    peer=chat, lane=Lane.BROADCAST,
+                )
                 if "-copy" in message.text
-                else await msg.forward(chat)
+                else await sender.call(msg.forward, chat, peer=chat, lane=Lane.BROADCAST)
             )
-            if chat in groups:
+            if group:
                 count += 1
             else:
                 ucount += 1
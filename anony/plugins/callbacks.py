@@ -7,7 +7,9 @@ import re
 
 from pyrogram import filters, types
 
-from anony import anon, app, db, lang, queue, tg, yt
+from anony import anon, app, db, lang, queue, sender, tg
+from anony.core.scheduler import Priority
+from anony.core.sender import Lane
 from anony.helpers import admin_check, buttons, can_manage_vc
 
 
@@ -77,11 +79,15 @@ async def _controls(_, query: types.CallbackQuery):
         except:
             pass
 
-        msg = await app.send_message(chat_id=chat_id, text=query.lang["play_next"])
-        if not media.file_path:
-            media.file_path = await yt.download(media.id, video=media.video)
+        msg = await sender.call(
+            app.send_message,
+            chat_id=chat_id,
+            text=query.lang["play_next"],
+            peer=chat_id,
+            lane=Lane.NOW_PLAYING,
+        )
         media.message_id = msg.id
-        return await anon.play_media(chat_id, msg, media)
+        return await anon.play_media(chat_id, msg, media, priority=Priority.FORCE)
 
     elif action == "replay":
         media = queue.get_current(chat_id)
@@ -97,7 +103,9 @@ async def _controls(_, query: types.CallbackQuery):
 
     try:
         if action in ["skip", "replay", "stop"]:
-            await query.message.reply_text(reply, quote=False)
+            await sender.call(
+                query.message.reply_text, reply, quote=False, peer=chat_id
+            )
             await query.message.delete()
         else:
             mtext = re.sub(
@@ -109,8 +117,12 @@ async def _controls(_, query: types.CallbackQuery):
             keyboard = buttons.controls(
                 chat_id, status=status if action != "resume" else None
             )
-        await query.edit_message_text(
-            f"{mtext}\n\n<blockquote>{reply}</blockquote>", reply_markup=keyboard
+        await sender.call(
+            query.edit_message_text,
+            f"{mtext}\n\n<blockquote>{reply}</blockquote>",
+            reply_markup=keyboard,
+            peer=chat_id,
+            key=("edit", chat_id, query.message.id),
         )
     except:
         pass
@@ -4,11 +4,14 @@
 
 
 import asyncio
+import heapq
 import time
 
 from pyrogram import enums, filters, types
+from pyrogram.errors import FloodWait
 
-from anony import anon, app, config, db, lang, queue, tasks, userbot
+from anony import anon, app, config, db, lang, queue, sender, tasks, userbot
+from anony.core.sender import Lane
 from anony.helpers import buttons
 
 
@@ -18,98 +21,205 @@ async def _watcher_vc(_, m: types.Message):
     await anon.stop(m.chat.id)
 
 
-async def auto_leave():
+async def auto_leave(batch=50, idle=3600):
+    """
+    Leave the chats each assistant has been idle in the longest, up to
+    `batch` per assistant every half hour, using the joined-chat index
+    instead of walking dialogs. Each assistant's dialogs are read once, to
+    seed the index with chats joined before it existed.
+    """
     while True:
         await asyncio.sleep(1800)
-        for ub in userbot.clients:
-            left = 0
+        for num, ub in enumerate(userbot.clients, start=1):
             try:
-                for dialog in await ub.get_dialogs():
-                    chat_id = dialog.chat.id
-                    if left >= 20:
-                        break
+                if num not in db.joined_seeded:
+                    await db.seed_joined(
+                        num,
+                        [
+                            dialog.chat.id
+                            async for dialog in ub.get_dialogs()
+                            if dialog.chat.type
+                            in [enums.ChatType.GROUP, enums.ChatType.SUPERGROUP]
+                        ],
+                    )
+
+                for chat_id in db.coldest_chats(num, batch, idle):
                     if chat_id in [app.logger, -1001686672798, -1001549206010]:
                         continue
-                    if dialog.chat.type in [
-                        enums.ChatType.GROUP,
-                        enums.ChatType.SUPERGROUP,
-                    ]:
-                        if chat_id in db.active_calls:
-                            continue
+                    try:
                         await ub.leave_chat(chat_id)
-                        left += 1
-                    await asyncio.sleep(5)
-            except:
+                    except FloodWait as e:
+                        await asyncio.sleep(e.value)
+                        continue
+                    except Exception:
+                        pass
+                    await db.rm_joined(num, chat_id)
+                    await asyncio.sleep(2)
+            except Exception:
                 continue
 
 
-async def track_time():
+IDLE = object()
+# chat_id -> [message_id, (timer, remove) of the last bar sent, or IDLE]
+timers: dict[int, list] = {}
+timer_stats = {"passes": 0, "edits": 0, "skipped": 0, "lag": 0.0, "max_lag": 0.0}
+
+
+def render_timer(media, length: int = 10, step: int = 1) -> tuple[str, bool]:
+    """
+    The progress bar for `media` and whether it should be removed. The
+    clock is floored to `step` seconds, so renders within one refresh
+    interval are identical.
+    """
+    duration = media.duration_sec
+    played = min(media.time, duration)
+    remaining = duration - played
+    pos = min(int((played / duration) * length), length - 1)
+    timer = "—" * pos + "◉" + "—" * (length - pos - 1)
+    if remaining < 10:
+        return timer, True
+    played -= played % step
+    timer = f"{time.strftime('%M:%S', time.gmtime(played))} | {timer} | -{time.strftime('%M:%S', time.gmtime(duration - played))}"
+    return timer, False
+
+
+def refresh_timer(chat_id: int, inflight: set, step: int = 1) -> None:
+    media = queue.get_current(chat_id)
+    if not media or not media.playing:
+        return
+    duration, message_id = media.duration_sec, media.message_id
+    if not duration or not message_id:
+        return
+
+    state = timers[chat_id]
+    if state[0] != message_id:
+        state[:] = [message_id, None]
+    elif state[1] is IDLE:
+        return
+
+    # Skip the edit when the bar would read the same, e.g. while paused.
+    timer, remove = render_timer(media, step=step)
+    if (timer, remove) == state[1]:
+        timer_stats["skipped"] += 1
+        return
+    # Once the bar is removed the message gets no further edits.
+    state[1] = IDLE if remove else (timer, remove)
+
+    def _done(fut):
+        inflight.discard(fut)
+        if not fut.cancelled() and fut.exception():
+            # Deleted or otherwise uneditable message: stop refreshing it.
+            if timers.get(chat_id, [None])[0] == message_id:
+                timers[chat_id][1] = IDLE
+
+    fut = sender.post(
+        app.edit_message_reply_markup,
+        chat_id=chat_id,
+        message_id=message_id,
+        reply_markup=buttons.controls(chat_id=chat_id, timer=timer, remove=remove),
+        peer=chat_id,
+        lane=Lane.TIMER,
+        key=("edit", chat_id, message_id),
+    )
+    inflight.add(fut)
+    fut.add_done_callback(_done)
+    timer_stats["edits"] += 1
+
+
+async def update_timer(interval: int = 7, limit: int = 20):
+    """
+    Refresh each chat's progress bar on its own deadline instead of in one
+    sequential sweep. Chats sit in a heap keyed by their next due time and
+    at most `limit` edits are in flight; a chat that finds the limit full is
+    retried a second later. `timer_stats` keeps the lag of the last pass
+    behind the deadlines and the worst seen.
+    """
+    heap: list[tuple[float, int]] = []
+    inflight: set[asyncio.Future] = set()
     while True:
-        await asyncio.sleep(1)
+        await asyncio.sleep(min(heap[0][0] - time.monotonic(), 1) if heap else 1)
+        now = time.monotonic()
         for chat_id in db.active_calls:
-            if not await db.playing(chat_id):
+            if chat_id not in timers:
+                timers[chat_id] = [0, None]
+                heapq.heappush(heap, (now + interval, chat_id))
+
+        lag, due_now = 0.0, False
+        while heap and heap[0][0] <= now:
+            due, chat_id = heapq.heappop(heap)
+            if chat_id not in db.active_calls:
+                timers.pop(chat_id, None)
                 continue
-            media = queue.get_current(chat_id)
-            if not media.playing:
-                continue
-            media.time += 1
-
-
-async def update_timer(length=10):
-    while True:
-        await asyncio.sleep(7)
-        for chat_id in db.active_calls:
-            if not await db.playing(chat_id):
+            if len(inflight) >= limit:
+                heapq.heappush(heap, (now + 1, chat_id))
                 continue
+            lag, due_now = max(lag, now - due), True
+            nxt = due + interval
+            heapq.heappush(heap, (nxt if nxt > now else now + interval, chat_id))
             try:
-                media = queue.get_current(chat_id)
-                duration, message_id = media.duration_sec, media.message_id
-                if not duration or not message_id or not media.playing:
-                    continue
-                played = media.time
-                remaining = duration - played
-                pos = min(int((played / duration) * length), length - 1)
-                timer = "—" * pos + "◉" + "—" * (length - pos - 1)
-
-                if remaining < 10:
-                    remove = True
-                else:
-                    remove = False
-                    timer = f"{time.strftime('%M:%S', time.gmtime(played))} | {timer} | -{time.strftime('%M:%S', time.gmtime(remaining))}"
-
-                await app.edit_message_reply_markup(
-                    chat_id=chat_id,
-                    message_id=message_id,
-                    reply_markup=buttons.controls(
-                        chat_id=chat_id, timer=timer, remove=remove
-                    ),
-                )
-            except:
+                if await db.playing(chat_id):
+                    refresh_timer(chat_id, inflight, step=interval)
+            except Exception:
                 pass
 
+        if not due_now:
+            continue
+        timer_stats["passes"] += 1
+        timer_stats["lag"] = round(lag, 3)
+        timer_stats["max_lag"] = max(timer_stats["max_lag"], timer_stats["lag"])
+
+
+async def vc_watcher(sleep=15, reconcile=300, grace=30, limit=5):
+    """
+    Leave voice chats nobody is listening in. Participant counts come from
+    anon's cache, kept current by join/leave updates; the API is only asked
+    for chats without a count yet and, as a safety net, for every chat once
+    per `reconcile` seconds, `limit` requests at a time. A chat has to stay
+    empty for `grace` seconds before the assistant leaves.
+    """
+    limiter = asyncio.Semaphore(limit)
+    last_sweep = time.monotonic()
+
+    async def count(chat_id: int):
+        async with limiter:
+            try:
+                await anon.count_participants(chat_id)
+            except Exception:
+                pass
 
-async def vc_watcher(sleep=15):
     while True:
         await asyncio.sleep(sleep)
-        for chat_id in db.active_calls:
-            client = await db.get_assistant(chat_id)
-            played = await client.time(chat_id)
-            participants = await client.get_participants(chat_id)
-            if len(participants) < 2 and played > 30:
+        sweep = time.monotonic() - last_sweep >= reconcile
+        if sweep:
+            last_sweep = time.monotonic()
+        stale = [
+            chat_id
+            for chat_id in list(db.active_calls)
+            if sweep or chat_id not in anon.participants
+        ]
+        if stale:
+            await asyncio.gather(*(count(chat_id) for chat_id in stale))
+
+        for chat_id in list(db.active_calls):
+            media = queue.get_current(chat_id)
+            if not media or media.time <= 30 or anon.alone_for(chat_id) < grace:
+                continue
+            try:
                 _lang = await lang.get_lang(chat_id)
                 sent = await app.edit_message_reply_markup(
                     chat_id=chat_id,
-                    message_id=queue.get_current(chat_id).message_id,
+                    message_id=media.message_id,
                     reply_markup=buttons.controls(
                         chat_id=chat_id, status=_lang["stopped"], remove=True
                     ),
                 )
                 await anon.stop(chat_id)
                 await sent.reply_text(_lang["auto_left"])
+            except Exception:
+                await anon.stop(chat_id)
 
 
 if config.AUTO_LEAVE:
     tasks.append(asyncio.create_task(auto_leave()))
-tasks.append(asyncio.create_task(track_time()))
 tasks.append(asyncio.create_task(update_timer()))
 tasks.append(asyncio.create_task(vc_watcher()))
@@ -6,6 +6,7 @@
 from pyrogram import filters, types
 
 from anony import anon, app, config, db, lang, queue, tg, yt
+from anony.core.scheduler import Priority
 from anony.helpers import buttons, utils
 from anony.helpers._play import checkUB
 
@@ -63,6 +64,7 @@ async def play_hndlr(
         position = queue.add(m.chat.id, file)
 
         if await db.get_call(m.chat.id):
+            anon.prefetch(m.chat.id)
             return await sent.edit_text(
                 m.lang["play_queued"].format(
                     position,
@@ -76,13 +78,9 @@ async def play_hndlr(
                 ),
             )
 
-    if not file.file_path:
-        try:
-            file.file_path = await yt.download(file.id, video=video)
-        except:
-            await anon.stop(m.chat.id)
-            return await sent.edit_text(
-                m.lang["error_no_file"].format(config.SUPPORT_CHAT)
-            )
-
-    await anon.play_media(chat_id=m.chat.id, message=sent, media=file)
+    await anon.play_media(
+        chat_id=m.chat.id,
+        message=sent,
+        media=file,
+        priority=Priority.FORCE if force else Priority.NOW_PLAYING,
+    )
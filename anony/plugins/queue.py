@@ -2,6 +2,7 @@
 # Licensed under the MIT License.
 # This file is part of AnonXMusic
 
+import time
 
 from pyrogram import filters, types
 
@@ -26,7 +27,7 @@ async def _queue_func(_, m: types.Message):
     _text = m.lang["queue_curr"].format(
         _media.url,
         _media.title[:50],
-        _media.duration,
+        f"{time.strftime('%M:%S', time.gmtime(_media.time))} / {_media.duration}",
         _media.user,
     )
     _queue.pop(0)
@@ -11,8 +11,13 @@ import psutil
 from pyrogram import __version__, filters, types
 from pytgcalls import __version__ as pytgver
 
-from anony import app, config, db, lang, userbot
+from anony import app, bandwidth, config, db, lang, scheduler, sender, userbot, yt
 from anony.plugins import all_modules
+from anony.plugins.misc import timer_stats
+
+
+def _pairs(stats: dict) -> str:
+    return ", ".join(f"{k}: {v}" for k, v in stats.items()) or "-"
 
 
 @app.on_message(filters.command(["stats"]) & filters.group & ~app.bl_users)
@@ -31,8 +36,8 @@ async def _stats(_, m: types.Message):
         len(db.blacklisted),
         len(app.bl_users),
         len(app.sudoers),
-        len(await db.get_chats()),
-        len(await db.get_users()),
+        await db.count_chats(),
+        await db.count_users(),
     )
     if m.from_user.id in app.sudoers:
         process = psutil.Process(pid)
@@ -51,3 +56,21 @@ async def _stats(_, m: types.Message):
             pytgver,
         )
     await sent.edit_caption(_utext)
+
+    if m.from_user.id in app.sudoers:
+        # Captions are capped at 1024 characters, so send these separately.
+        await sent.reply_text(
+            m.lang["stats_perf"].format(
+                "\n".join(
+                    f"{p}: {_pairs(s)}" for p, s in scheduler.stats().items()
+                ),
+                _pairs(bandwidth.stats()),
+                _pairs(sender.stats()),
+                "\n".join(
+                    f"{c.pop('cookie')}: {_pairs(c)}" for c in yt.cookies.stats()
+                ) or "-",
+                _pairs(yt.rungs),
+                _pairs(yt.search_stats),
+                _pairs(timer_stats),
+            )
+        )
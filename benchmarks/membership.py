@@ -0,0 +1,69 @@
+# Copyright (c) 2025 AnonymousX1025
+# Licensed under the MIT License.
+# This file is part of AnonXMusic
+
+"""
+Compare membership checks on the id indexes MongoDB keeps in memory
+(chats, users, blacklisted): the old list, the set that replaced it and
+a sorted array('q') searched with bisect, with the memory each one takes.
+
+    python benchmarks/membership.py [sizes...]
+"""
+
+import random
+import sys
+import time
+import tracemalloc
+from array import array
+from bisect import bisect_left
+
+LOOKUPS = 2000
+
+
+def build(kind: str, ids: list[int]):
+    if kind == "list":
+        return list(ids)
+    if kind == "set":
+        return set(ids)
+    return array("q", sorted(ids))
+
+
+def contains(kind: str, index, value: int) -> bool:
+    if kind == "array":
+        i = bisect_left(index, value)
+        return i < len(index) and index[i] == value
+    return value in index
+
+
+def measure(kind: str, ids: list[int], probes: list[int]) -> tuple[float, float]:
+    tracemalloc.start()
+    index = build(kind, ids)
+    memory = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    tracemalloc.stop()
+
+    # A list scan at 1M entries is slow enough that fewer probes suffice.
+    probes = probes[:50] if kind == "list" and len(ids) > 100_000 else probes
+    start = time.perf_counter()
+    for value in probes:
+        contains(kind, index, value)
+    per_op = (time.perf_counter() - start) / len(probes) * 1e6
+    return per_op, memory
+
+
+def main(sizes: list[int]) -> None:
+    rng = random.Random(0)
+    for size in sizes:
+        ids = rng.sample(range(1, 10**10), size)
+        # Half hits, half misses, like a mix of known and new users.
+        probes = rng.sample(ids, LOOKUPS // 2) + [
+            rng.randrange(10**10, 2 * 10**10) for _ in range(LOOKUPS // 2)
+        ]
+        rng.shuffle(probes)
+        print(f"{size:,} ids")
+        for kind in ("list", "set", "array"):
+            per_op, memory = measure(kind, ids, probes)
+            print(f"  {kind:<6} {per_op:12.3f} us/lookup {memory:10.1f} MiB")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [10_000, 1_000_000])
@@ -0,0 +1,53 @@
+# Copyright (c) 2025 AnonymousX1025
+# Licensed under the MIT License.
+# This file is part of AnonXMusic
+
+"""
+Measure the per-download setup cost that YouTube._ydl saves by reusing
+YoutubeDL instances instead of building one per call.
+
+    python benchmarks/ytdl_pool.py [iterations]
+"""
+
+import sys
+import time
+
+import yt_dlp
+
+OPTS = {
+    "outtmpl": "downloads/%(id)s.%(ext)s",
+    "quiet": True,
+    "noplaylist": True,
+    "geo_bypass": True,
+    "no_warnings": True,
+    "overwrites": False,
+    "ignoreerrors": True,
+    "nocheckcertificate": True,
+    "format": "bestaudio[acodec=opus]",
+    "postprocessors": [{"key": "FFmpegExtractAudio", "preferredcodec": "best"}],
+}
+
+
+def fresh(n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        with yt_dlp.YoutubeDL(OPTS) as ydl:
+            ydl.get_info_extractor("Youtube")
+    return (time.perf_counter() - start) / n
+
+
+def pooled(n: int) -> float:
+    ydl = yt_dlp.YoutubeDL(OPTS)
+    start = time.perf_counter()
+    for _ in range(n):
+        ydl.get_info_extractor("Youtube")
+    return (time.perf_counter() - start) / n
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    fresh(5)  # warm up imports and lazy extractors
+    a, b = fresh(n), pooled(n)
+    print(f"fresh instance : {a * 1000:.3f} ms/download")
+    print(f"pooled instance: {b * 1000:.3f} ms/download")
+    print(f"saved          : {(a - b) * 1000:.3f} ms/download")
@@ -26,6 +26,24 @@ class Config:
         self.PING_IMG = getenv("PING_IMG", "https://files.catbox.moe/haagg2.png")
         self.START_IMG = getenv("START_IMG", "https://files.catbox.moe/zvziwk.jpg")
         self.VIDEO_PLAY: bool = getenv("VIDEO_PLAY", True)
+        self.DOWNLOAD_WORKERS = int(getenv("DOWNLOAD_WORKERS", 4))
+        self.BANDWIDTH_LIMIT = int(getenv("BANDWIDTH_LIMIT", 0))  # in MB/s, 0 = unlimited
+        self.STREAM_RESERVE = int(getenv("STREAM_RESERVE", 64))  # in KB/s per active call
+        self.TG_STREAM: bool = getenv("TG_STREAM", "False").lower() in ("true", "1")
+        self.TG_STREAM_BUFFER = int(getenv("TG_STREAM_BUFFER", 15))  # in seconds
+        self.PARALLEL_DL_SIZE = int(getenv("PARALLEL_DL_SIZE", 20))  # in MB
+        self.PARALLEL_DL_RANGE = int(getenv("PARALLEL_DL_RANGE", 8))  # in 1 MB chunks
+        self.SEND_RATE = int(getenv("SEND_RATE", 25))  # Bot API calls per second
+        self.COOKIE_LIMIT = int(getenv("COOKIE_LIMIT", 2))
+        self.MAX_CALLS = int(getenv("MAX_CALLS", 0))  # per assistant, 0 = unlimited
+        self.PREFETCH_LIMIT = int(getenv("PREFETCH_LIMIT", 3))
+        self.STREAM_MODE: bool = getenv("STREAM_MODE", "False").lower() in ("true", "1")
+        self.STORAGE_LIMIT = int(getenv("STORAGE_LIMIT", 5120))  # in MB
+        self.SEARCH_CACHE_TTL = int(getenv("SEARCH_CACHE_TTL", 86400))  # in seconds
+        self.LAZY_LOAD: bool = getenv("LAZY_LOAD", "True").lower() in ("true", "1")
+        self.LOAD_BATCH = int(getenv("LOAD_BATCH", 5000))  # documents per cursor batch
+        self.WRITE_BATCH = int(getenv("WRITE_BATCH", 500))  # buffered writes before a flush
+        self.WRITE_DELAY = int(getenv("WRITE_DELAY", 2))  # in seconds between flushes
 
     def check(self):
         missing = [